@@ -0,0 +1,116 @@
+#!/usr/bin/env python3
+
+import threading
+
+class Background:
+    '''Runs long work, such as indexing, reading headers and hashing, on a thread of its own.
+
+    Jobs run one after the other, so they never compete with each other
+    for the disk. The function of a job runs on the background thread and
+    must not touch anything the main loop uses. It returns a result: a
+    callable that applies what was done, or None. Results are applied by
+    apply() on the main thread. Jobs belong to a group, and advance()
+    drops the jobs of the group submitted before it, whether they have
+    run or not. The callback is called once when results are waiting, not
+    once per result.
+    '''
+    def __init__(self, callback=None):
+        self.callback = callback
+        self.generations = {}
+        self._queue = []
+        self._done = []
+        self._cond = threading.Condition()
+        self._thread = None
+
+    def __repr__(self):
+        return "<Background %i queued>" % len(self._queue)
+
+    def advance(self, group):
+        '''Start a new generation of group, dropping its jobs.
+        @return: int - the new generation
+        '''
+        with self._cond:
+            self.generations[group] = self.generations.get(group, 0) + 1
+            return self.generations[group]
+
+    def submit(self, function, group):
+        '''Run function on the background thread after the jobs before it.'''
+        with self._cond:
+            self._queue.append((group, self.generations.get(group, 0), function))
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run)
+                self._thread.daemon = True
+                self._thread.start()
+            self._cond.notify()
+
+    def _current(self, group, generation):
+        return generation == self.generations.get(group, 0)
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._queue:
+                    self._cond.wait()
+                group, generation, function = self._queue.pop(0)
+                if not self._current(group, generation):
+                    continue
+            try:
+                result = function()
+            except Exception as e:
+                print("Background %s failed (%s)" % (group, e.__class__.__name__))
+                result = None
+            if result is None:
+                continue
+            with self._cond:
+                # One wakeup until the main loop has applied, not one per result
+                signal = len(self._done) == 0
+                self._done.append((group, generation, result))
+            if signal and not self.callback is None:
+                self.callback()
+
+    def apply(self):
+        '''Apply the results of finished jobs that are still wanted, on the main thread.
+        @return: int - the number of results applied
+        '''
+        with self._cond:
+            done = self._done
+            self._done = []
+            wanted = [result for group, generation, result in done if self._current(group, generation)]
+        for result in wanted:
+            result()
+        return len(wanted)
+
+_background = None
+_background_lock = threading.Lock()
+
+def shared():
+    '''The Background of this process.'''
+    global _background
+    with _background_lock:
+        if _background is None:
+            _background = Background()
+        return _background
+
+def run_batches(keys, work, apply, group, size=1000):
+    '''Work through keys in the background, one batch after the other.
+
+    work(batch) runs on the background thread and must not touch anything
+    the main loop uses. apply(result, finished) runs on the main loop after
+    each batch, with the number of keys done so far; the run is over when
+    that is len(keys). A new run of the same group drops what is left of
+    the last one.
+    '''
+    background = shared()
+    background.advance(group)
+    def step(start):
+        batch = keys[start:start + size]
+        def run():
+            result = work(batch)
+            def done():
+                finished = start + len(batch)
+                apply(result, finished)
+                if finished < len(keys):
+                    step(finished)
+            return done
+        background.submit(run, group)
+    step(0)
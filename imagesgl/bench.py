@@ -0,0 +1,142 @@
+#!/usr/bin/env python3
+
+'''Throughput benchmarks, run with python -m imagesgl.bench.'''
+
+import multiprocessing
+import os
+import resource
+import shutil
+import sys
+import tempfile
+import time
+from optparse import OptionParser
+import pygame
+from PIL import Image
+from imagesgl.thumbnailer import Job, THUMB_SHAPES, Thumbnailer
+from imagesgl.thumbpack import ThumbPack
+from imagesgl.tiles import TiledImage, turn
+from imagesgl import decode
+
+def find_images(root, limit):
+    images = []
+    for r, ds, fs in os.walk(root):
+        ds[:] = [d for d in ds if not d.startswith('.')]
+        for f in sorted(fs):
+            if f.split('.')[-1].lower() in ('jpg', 'jpeg'):
+                images.append(os.path.join(r, f))
+                if len(images) >= limit:
+                    return images
+    return images
+
+def bench_thumbnails(images, workers, block_size=200):
+    '''Create thumbnails of all shapes of images into a pack in a temporary folder.
+    @return: float - images per second
+    '''
+    out = tempfile.mkdtemp(prefix='images-bench-')
+    try:
+        pack = ThumbPack(out)
+        pack.open()
+        jobs = [Job(str(i), f, THUMB_SHAPES, block_size, 0, pack) for i, f in enumerate(images)]
+        thumbnailer = Thumbnailer(workers=workers)
+        start = time.time()
+        thumbnailer.submit(jobs)
+        while thumbnailer.busy:
+            time.sleep(0.01)
+        elapsed = time.time() - start
+        errors = [error for key, error in thumbnailer.drain() if not error is None]
+        thumbnailer.shutdown()
+        pack.close()
+        if errors:
+            print("%i errors, first: %s" % (len(errors), errors[0]))
+        return len(images) / elapsed
+    finally:
+        shutil.rmtree(out)
+
+def _decode(images, box, draft, results):
+    before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    start = time.time()
+    for f in images:
+        with Image.open(f) as img:
+            if draft:
+                img.draft(img.mode, box)
+            img.load()
+    elapsed = time.time() - start
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - before
+    results.put((elapsed / len(images), peak))
+
+def bench_decode(images, draft, box=(200, 200)):
+    '''Decode images fully or in draft mode, in a fresh process so the peak memory is its own.
+    @return: tuple(seconds per image, peak memory growth in KB)
+    '''
+    ctx = multiprocessing.get_context('fork')
+    results = ctx.Queue()
+    p = ctx.Process(target=_decode, args=(images, box, draft, results))
+    p.start()
+    result = results.get()
+    p.join()
+    return result
+
+def _timed(function, repeat):
+    start = time.time()
+    for i in range(repeat):
+        function()
+    return (time.time() - start) / repeat
+
+def bench_transforms(image, winsize=(1280, 720), repeat=10):
+    '''Time the ways of turning and scaling a decoded image for display.
+    @return: list of tuple(name, seconds per call)
+    '''
+    surface = decode.load(image)[0]
+    iw, ih = surface.get_size()
+    win = pygame.Surface(winsize)
+    fit = min(float(winsize[0]) / iw, float(winsize[1]) / ih)
+    def draw(tiled, scale):
+        return lambda: tiled.draw(win, scale, (0, 0))
+    cold = lambda scale: lambda: TiledImage(surface, 90).draw(win, scale, (0, 0))
+    warm = TiledImage(surface, 90)
+    warm.draw(win, fit, (0, 0))
+    return [
+        ('rotozoom 90, fit', _timed(lambda: pygame.transform.rotozoom(surface, 90, fit), repeat)),
+        ('rotozoom 90, 2x', _timed(lambda: pygame.transform.rotozoom(surface, 90, 2.0), 1)),
+        ('turn 90', _timed(lambda: turn(surface, 90), repeat)),
+        ('turn 180', _timed(lambda: turn(surface, 180), repeat)),
+        ('smoothscale fit', _timed(lambda: pygame.transform.smoothscale(surface, (int(iw * fit), int(ih * fit))), repeat)),
+        ('tiles 90, fit, cold', _timed(cold(fit), repeat)),
+        ('tiles 90, fit, cached', _timed(draw(warm, fit), repeat)),
+        ('tiles 90, 1x', _timed(draw(warm, 1.0), repeat)),
+        ('tiles 90, 2x', _timed(draw(warm, 2.0), repeat)),
+    ]
+
+def main(argv):
+    parser = OptionParser(usage="python -m imagesgl.bench [options] folder")
+    parser.add_option('-n', '--workers', dest='workers', type='int', default=os.cpu_count(),
+        help='number of workers to compare with a single one (default: cores)')
+    parser.add_option('-l', '--limit', dest='limit', type='int', default=200,
+        help='number of images to use')
+    parser.add_option('-t', '--transforms', dest='transforms', action='store_true', default=False,
+        help='only time rotating and zooming the first image')
+    options, args = parser.parse_args(argv)
+    images = find_images(args[0] if args else '.', options.limit)
+    if not images:
+        print("No images found")
+        return 1
+    if options.transforms:
+        print("Transforms of %s" % images[0])
+        for name, seconds in bench_transforms(images[0]):
+            print("  %-22s %8.2f ms" % (name + ':', seconds * 1000))
+        return 0
+    print("Decoding %i images" % len(images))
+    full_time, full_peak = bench_decode(images, False)
+    draft_time, draft_peak = bench_decode(images, True)
+    print("  full:   %7.1f ms/image, peak +%i MB" % (full_time * 1000, full_peak // 1024))
+    print("  draft:  %7.1f ms/image, peak +%i MB" % (draft_time * 1000, draft_peak // 1024))
+    print("Thumbnails of %i images" % len(images))
+    single = bench_thumbnails(images, 1)
+    print("  1 worker:   %7.1f images/s" % single)
+    if options.workers > 1:
+        multi = bench_thumbnails(images, options.workers)
+        print("%3i workers:  %7.1f images/s (%.1fx)" % (options.workers, multi, multi / single))
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -1,9 +1,13 @@
 #!/usr/bin/env python3
 
 import math
+import time
 import threading
 import os.path
 import json
+from imagesgl.entry import Entry, IMAGE
+from imagesgl.thumbnailer import SOURCE_DECODE
+from imagesgl import loader, imagecache
 
 # Browser modes
 MODE_NORMAL = 'normal'
@@ -11,14 +15,48 @@ MODE_THUMBS = 'thumbs'
 MODE_INPUT = 'input'
 MODE_ANY = '*'
 
+# Entries laid out per step while the layout is finished in the background
+LAYOUT_STEP = 5000
+
+class EntryList:
+    '''The entries of a browser, looked up in the directory on first access.'''
+    def __init__(self, directory, keys):
+        self.directory = directory
+        entries = directory.entries
+        self.keys = [key for key in keys if key in entries]
+        self._entries = [None] * len(self.keys)
+
+    def __repr__(self):
+        return "<EntryList %i>" % len(self.keys)
+
+    def __len__(self):
+        return len(self.keys)
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self[j] for j in range(*i.indices(len(self.keys)))]
+        entry = self._entries[i]
+        if entry is None:
+            entry = self._entries[i] = self.directory[self.keys[i]]
+        return entry
+
+    def __iter__(self):
+        for i in range(len(self.keys)):
+            yield self[i]
+
+    def materialized(self):
+        '''The entries that have been looked up so far.'''
+        for entry in self._entries:
+            if not entry is None:
+                yield entry
+
 class Browser:
     def __init__(self, directory, mode):
         self.mode = mode
         self.directory = directory
-        self.entries = []
+        self.entries = EntryList(directory, [])
         self.selected_index = 0
         self.selected_image = None
-        self.loader_callback = None
         self.block_size = 200
         self.border = 5
         self.name = "Unititled collection"
@@ -28,7 +66,15 @@ class Browser:
         self.thumb_scroll_target = 0
         self.thumb_map = []
         self.thumb_pos = []
-        self.distributed = False
+        self._layout_valid = False
+        self._layout_width = 0
+        self._laid_out = 0
+        self._free_row = 0
+        self._wanted_view = None
+        self._thumbs_rows = None
+        self._direction = 1
+        self._selected_at = None
+        self._shown = set()
         
         self.filename = None
 
@@ -57,37 +103,38 @@ class Browser:
         return "%s - %i items" % (self.name, len(self.entries))
 
     def get_filtered(self, incl='', excl=''):
-        incl = incl.upper()
-        excl = excl.upper()
-        for entry in self.entries:
-            ok = True
-            for f in incl:
-                if not f in entry.categories:
-                    ok = False
-                    break
-            for f in excl:
-                if f in entry.categories:
-                    ok = False
-                    break
-            if ok: yield entry
+        for i in self._filtered_indices(incl, excl):
+            yield self.entries[i]
 
     def get_filtered_keys(self, incl='', excl=''):
-        incl = incl.upper()
-        excl = excl.upper()
-        for entry in self.get_filtered(incl=incl, excl=excl):
-            yield entry.filename
+        for i in self._filtered_indices(incl, excl):
+            yield self.entries.keys[i]
+
+    def _filtered_indices(self, incl, excl):
+        # Uses the category index of the directory, so entries are not looked up
+        if not incl and not excl:
+            return range(len(self.entries))
+        allowed = set(self.directory.get_filtered_keys(incl=incl, excl=excl))
+        return [i for i, key in enumerate(self.entries.keys) if key in allowed]
+
+    def _marked(self):
+        # Only decoded entries can be marked, through this browser or another
+        entries = self.directory.entries
+        for key in self.entries.keys:
+            image = entries.get(key)
+            if isinstance(image, Entry) and image.marked:
+                yield image
 
     def get_marked_keys(self):
-        for image in self.entries:
-            if image.marked: yield image.filename
+        for image in self._marked():
+            yield image.filename
     
     @property
     def marked(self):
-        for image in self.entries:
-            if image.marked: yield image
+        return self._marked()
 
     def mark_none(self):
-        for image in self.entries:
+        for image in list(self._marked()):
             image.marked = False
 
     def mark_all(self):
@@ -102,14 +149,60 @@ class Browser:
 
     def use_keys(self, keys, winsize=None):
         self.distributed = False
-        self.entries = [self.directory[key] for key in keys if key in self.directory]
+        self.entries = EntryList(self.directory, keys)
         self.selected_index = 0
         self.select(0, winsize=winsize)
 
+    def apply_scan(self, result):
+        '''Follow a batch of changes to the directory with a single relayout.
+        New files only show up in directory views, not in saved collections.
+        '''
+        if not len(result):
+            return
+        removed = set(result.removed)
+        moved = dict(result.moved)
+        for image in self.entries.materialized():
+            if image.filename in removed:
+                image.unload()
+        keys = [moved.get(key, key) for key in self.entries.keys]
+        keys = [key for key in keys if not key in removed]
+        if self.filename is None:
+            keys.extend(result.added)
+            keys.sort()
+        selected = self.selected_image
+        self.entries = EntryList(self.directory, keys)
+        self.distributed = False
+        if not selected is None and selected.filename in self.directory:
+            self.selected_index = self.entries.keys.index(selected.filename)
+        else:
+            self.selected_index = min(self.selected_index, len(self.entries) - 1)
+        self.selected_index = max(0, self.selected_index)
+        self.selected_image = self.entries[self.selected_index] if len(self.entries) else None
+
+    def remove_keys(self, keys):
+        '''Take keys out of the view with a single relayout, keeping the selection.'''
+        removed = set(keys)
+        if removed.isdisjoint(self.entries.keys):
+            return
+        for image in self.entries.materialized():
+            if image.filename in removed:
+                image.unload()
+        selected = self.selected_image
+        self.entries = EntryList(self.directory, [key for key in self.entries.keys if not key in removed])
+        self.distributed = False
+        if not selected is None and not selected.filename in removed and selected.filename in self.directory:
+            self.selected_index = self.entries.keys.index(selected.filename)
+        else:
+            self.selected_index = min(self.selected_index, len(self.entries) - 1)
+        self.selected_index = max(0, self.selected_index)
+        self.selected_image = self.entries[self.selected_index] if len(self.entries) else None
+
     def select(self, delta, winsize=None):
         if len(self.entries) == 0:
             return
         # Stepping with wrapping
+        if delta:
+            self._direction = 1 if delta > 0 else -1
         self.selected_index += delta
         if self.selected_index < 0:
             self.selected_index = len(self.entries) - 1
@@ -118,6 +211,7 @@ class Browser:
 
         #print("Selecting", self.selected_index)
         self.selected_image = self.entries[self.selected_index]
+        self._selected_at, self._shown = time.time(), set()
         if self.mode == MODE_NORMAL:
             self.load_neighborhood(winsize=winsize)
 
@@ -129,10 +223,11 @@ class Browser:
         self.select(0, winsize=winsize)
 
     def move(self, d, winsize=None):
-        if len(self.entries) == 0:
+        if len(self.entries) == 0 or not self._layout_width:
             return
         dx, dy = d
-        wbw, wbh = len(self.thumb_map[0]), len(self.thumb_map)
+        wbw = self._layout_width
+        self._distribute(wbw, until_index=self.selected_index)
         x, y = self.thumb_pos[self.selected_index]
         #print((dx, dy), (wbw, wbh), (x, y))
         while self.thumb_map[y][x] == self.selected_index:
@@ -144,56 +239,155 @@ class Browser:
             elif x >= wbw:
                 x = 0
                 y += 1
+            # Wrapping around needs the complete layout
+            if y < 0 or y >= len(self.thumb_map) - 1:
+                self._distribute(wbw, until_row=y + 2 if y >= 0 else None)
+            wbh = len(self.thumb_map)
             if y < 0:
                 y = wbh - 1
             elif y >= wbh:
                 y = 0
         self.goto(self.thumb_map[y][x], winsize)
         
-        
+    def prefetch_window(self):
+        '''The indices to keep loaded around the selection, the selection first.
+
+        More images are loaded ahead in the direction of the last step than
+        behind, see the prefetch_ahead and prefetch_behind settings.
+        '''
+        n = len(self.entries)
+        ahead = self.directory.settings.get('prefetch_ahead', 4)
+        behind = self.directory.settings.get('prefetch_behind', 1)
+        window = [self.selected_index]
+        for i in range(1, max(ahead, behind) + 1):
+            if i <= ahead:
+                window.append((self.selected_index + self._direction * i) % n)
+            if i <= behind:
+                window.append((self.selected_index - self._direction * i) % n)
+        return sorted(set(window), key=window.index)
+
     def load_neighborhood(self, winsize=None):
-        c = self.selected_index
-        n = self.selected_index + 1 if ((self.selected_index + 2) <= len(self.entries)) else 0
-        p = self.selected_index - 1 if self.selected_index > 0 else len(self.entries) - 1
-        for i, image in enumerate(self.entries):
-            if not i in (c, n, p):
-                image.unload()
-        for i in (c, n, p): 
-            image = self.entries[i]
-            if not image.loaded:
+        '''Load the images of the prefetch window, others stay loaded until the image cache is full.'''
+        window = [self.entries[i] for i in self.prefetch_window()]
+        cache = imagecache.shared()
+        cache.pin(window)
+        # Images queued for an earlier selection are not needed any more
+        loader.shared().advance(IMAGE)
+        if not window[0].loaded and not winsize is None:
+            window[0].load_placeholder(self.directory.basepath, winsize)
+        for image in window:
+            if not image.decoded:
                 image.load_image_threaded(
                     basepath=self.directory.basepath, 
-                    callback=self.loader_callback if i==c else None,
                     winsize=winsize
                 )
-            elif i == c:
-                self.loader_callback()
+        for image in reversed(window):
+            cache.touch(image)
+
+    def shown(self, entry):
+        '''Report the time from selecting entry to the first frame showing it.
+
+        Called after every frame of the image view; the placeholder and the
+        decoded image are reported once each.
+        '''
+        if self._selected_at is None or entry != self.selected_image or entry.view is None:
+            return
+        stage = 'placeholder' if entry.view.placeholder else 'image'
+        if stage in self._shown:
+            return
+        self._shown.add(stage)
+        print("Showed %s of %s %.1fms after selecting it" % (stage, entry.filename, (time.time() - self._selected_at) * 1000))
+        if stage == 'image':
+            self._selected_at = None
 
     def unload(self):
-        for i, image in enumerate(self.entries):
+        for image in self.entries.materialized():
             image.unload()
             image.unload_thumbnail()
 
-    def load_thumbs(self):
-        for i, image in enumerate(self.entries):
-            image.load_thumbnail(self.directory.basepath, callback=self.loader_callback)
+    def create_thumbs(self, override=False, thumbnailer=None, source=SOURCE_DECODE, upgrade=False):
+        '''Create missing thumbnails, or all of them with override.
+        With a Thumbnailer they are created in the background, otherwise one by one.
+
+        From SOURCE_PREVIEW, thumbnails are taken from embedded previews
+        where they are large enough, which is much faster than decoding.
+        With upgrade, thumbnails made from previews are then made again
+        from the images, after all others are done.
+        '''
+        basepath = self.directory.basepath
+        images = [image for image in self.entries if image.entry_type == IMAGE]
+        passes = [(source, [image for image in images
+                            if override or not image.has_thumbnail(basepath, self.block_size, self.border,
+                                                                   full=upgrade and source == SOURCE_DECODE)])]
+        if upgrade and source != SOURCE_DECODE:
+            passes.append((SOURCE_DECODE, [image for image in images
+                                           if override or not image.has_thumbnail(basepath, self.block_size, self.border, full=True)]))
+        if thumbnailer is None:
+            for source, todo in passes:
+                for image in todo:
+                    image.create_thumbnail(basepath, border=self.border, block_size=self.block_size,
+                        override=override or source == SOURCE_DECODE and upgrade, source=source)
+            return
+        jobs = []
+        for source, todo in passes:
+            jobs.extend([image.thumbnail_job(basepath, self.block_size, self.border, source) for image in todo])
+        print("Creating %i thumbnails with %r" % (len(jobs), thumbnailer))
+        thumbnailer.submit(jobs)
 
-    def create_thumbs(self, override=False):
-        for i, image in enumerate(self.entries):
-            image.create_thumbnail(self.directory.basepath, border=self.border, block_size=self.block_size, override=override)
+    def wanted_thumbnails(self, winsize, source=SOURCE_DECODE):
+        '''Jobs for the missing thumbnails around the view.
+
+        The visible tiles come first, then those of the next and of the
+        previous screen. Tiles further away are left to create_thumbs.
+        @return: list of Job - or None if the view has not changed since the last call
+        '''
+        if len(self.entries) == 0:
+            return None
+        with_border = self.block_size + self.border * 2
+        wbw, wbh = self.get_block_dimensions(winsize, with_border)
+        start = self.thumb_start_row
+        self._distribute(wbw, until_row=start + 2 * wbh + 2)
+        view = (start, wbw, wbh, self.block_size, self.border, self._laid_out, len(self.entries), source)
+        if view == self._wanted_view:
+            return None
+        self._wanted_view = view
+        basepath = self.directory.basepath
+        jobs = []
+        seen = set()
+        for first, last in ((start, start + wbh), (start + wbh, start + 2 * wbh), (max(0, start - wbh), start)):
+            for row in self.thumb_map[first:last]:
+                for i in row:
+                    if i is None or i in seen:
+                        continue
+                    seen.add(i)
+                    image = self.entries[i]
+                    if image.entry_type == IMAGE and not image.has_thumbnail(basepath, self.block_size, self.border):
+                        jobs.append(image.thumbnail_job(basepath, self.block_size, self.border, source))
+        return jobs
 
     def get_block_dimensions(self, winsize, block_size):
         ww, wh = winsize
         return int(float(ww)/block_size), int(float(wh)/block_size)
 
-    def _get_first_free(self, m, i, size):
+    @property
+    def distributed(self):
+        return self._layout_valid and self._laid_out >= len(self.entries)
+
+    @distributed.setter
+    def distributed(self, value):
+        if not value:
+            self._layout_valid = False
+
+    def _get_first_free(self, m, i, size, start=0):
         if len(m) == 0:
             return -1, -1
         ow, oh = len(m[0]), len(m)
         iw, ih = size
-        for y in range(oh - ih + 1):
+        for y in range(start, oh - ih + 1):
             for x in range(ow - iw + 1):
                 if m[y][x] is None:
+                    if not all([m[y+iy][x+ix] is None for ix in range(iw) for iy in range(ih)]):
+                        continue
                     for ix in range(iw):
                         for iy in range(ih):
                             #print("Setting:", x+ix, y+iy) 
@@ -201,24 +395,52 @@ class Browser:
                     return x, y
         return -1, -1
 
-    def _distribute(self, wbw, wbh):
-        if self.distributed:
-            return
-        print(" * Redistributing * ")
-        self.thumb_map = []
-        self.thumb_pos = [None for x in range(len(self.entries))]
-        for i, image in enumerate(self.entries):
-            bw, bh = image.thumb_size
+    def _distribute(self, wbw, until_row=None, until_index=None, count=None):
+        '''Lay out the thumbnails first-fit into a map of blocks.
+
+        The layout is built incrementally: it stops as soon as the entry at
+        until_index is placed, or all rows above until_row are full, or
+        count entries have been placed, and continues from there on the
+        next call. Without limits everything is laid out.
+        '''
+        if not self._layout_valid or self._layout_width != wbw:
+            print(" * Redistributing * ")
+            self.thumb_map = []
+            self.thumb_pos = [None for x in range(len(self.entries))]
+            self._layout_valid = True
+            self._layout_width = wbw
+            self._laid_out = 0
+            self._free_row = 0
+        stop = len(self.entries) if count is None else min(len(self.entries), self._laid_out + count)
+        while self._laid_out < stop:
+            i = self._laid_out
+            if not until_index is None and i > until_index and (until_row is None or self._free_row >= until_row):
+                break
+            if until_index is None and not until_row is None and self._free_row >= until_row:
+                break
+            bw, bh = self.entries[i].thumb_size
+            bw = min(bw, wbw)
             #print((ww, wh), (wbw, wbh), (bw, bh))
             (x, y) = (-1, -1)
             while (x, y) == (-1, -1):
-                x, y = self._get_first_free(self.thumb_map, i, (bw, bh))
+                x, y = self._get_first_free(self.thumb_map, i, (bw, bh), self._free_row)
                 self.thumb_pos[i] = (x, y)
                 if (x, y) == (-1, -1):
                     self.thumb_map.append([None for x in range(wbw)])
+            self._laid_out += 1
+            while self._free_row < len(self.thumb_map) and not None in self.thumb_map[self._free_row]:
+                self._free_row += 1
         #for r in self.thumb_map:
         #    print(' '.join(["%4s" % str(c) for c in r]))
-        self.distributed = True
+
+    def distribute_step(self):
+        '''Lay out the next chunk of a layout that is not complete yet.
+        @return: boolean - True if there is more to do
+        '''
+        if self.distributed or not self._layout_valid:
+            return False
+        self._distribute(self._layout_width, count=LAYOUT_STEP)
+        return not self.distributed
         
     def _ensure_selected_visible(self, wbh):
         i, (w, h) = self.selected_index, self.selected_image.thumb_size
@@ -253,13 +475,18 @@ class Browser:
         ww, wh = winsize
         with_border = self.block_size + self.border * 2
         wbw, wbh = self.get_block_dimensions(winsize, with_border)
-        self._distribute(wbw, wbh)
+        self._distribute(wbw, until_index=self.selected_index)
         self._ensure_selected_visible(wbh)
+        self._distribute(wbw, until_row=self.thumb_start_row + wbh + 2)
         left_margin = (ww - wbw * with_border) / 2
         top_margin = 35
         min_height = 0
         start_row = max(0, self.thumb_start_row - 2)
         end_row = min(len(self.thumb_map), self.thumb_start_row + wbh + 1)
+        if (start_row, end_row) != self._thumbs_rows:
+            # Thumbnails queued for rows scrolled out of view are not needed any more
+            self._thumbs_rows = (start_row, end_row)
+            loader.shared().advance('thumbnail')
         drawn = []
         for y_, row in enumerate(self.thumb_map[start_row:end_row]):
             y = start_row + y_
@@ -272,5 +499,6 @@ class Browser:
                     x_pos = x * with_border + left_margin
                     y_pos = (y - self.thumb_start_row) * with_border + top_margin
                     if not image.loaded_thumb:
-                        image.load_thumbnail_threaded(self.directory.basepath, callback=self.loader_callback)
+                        image.load_thumbnail_threaded(self.directory.basepath,
+                            block_size=self.block_size, border=self.border)
                     yield image, x_pos, y_pos, image == self.selected_image
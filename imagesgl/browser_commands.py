@@ -3,6 +3,9 @@
 from imagesgl.command import Param, Command, NeedsEnv, NeedsInterpreter, NeedsBrowser, NeedsDirectory, NeedsEntry, Shortcut, ShortcutSet
 from imagesgl.command import MOD_CTRL, MOD_SHIFT, MOD_NONE, LETTER
 from imagesgl.browser import Browser, MODE_NORMAL, MODE_THUMBS, MODE_INPUT
+from imagesgl.hashing import hash_files
+from imagesgl import background
+from imagesgl.thumbnailer import SOURCE_DECODE
 import pygame
 from pygame.locals import *
 
@@ -14,8 +17,7 @@ def __repr__(): return "<module Browser Commands>"
 
 def create(directory, keys=None):
     b = Browser(directory, MODE_THUMBS)
-    b.loader_callback = lambda: pygame.event.post(pygame.event.Event(pygame.USEREVENT, action='loaded'))
-    keys = keys if not keys is None else sorted(directory.entries.keys())
+    keys = keys if not keys is None else sorted(directory.keys())
     b.use_keys(keys, winsize=pygame.display.get_surface().get_size())
     return b
 
@@ -36,6 +38,8 @@ def create(directory, keys=None):
 @Shortcut(MODE_NORMAL, MOD_NONE,  K_SPACE,     'select', +1)
 @Shortcut(MODE_NORMAL, MOD_NONE,  K_BACKSPACE, 'select', -1)
 @Shortcut(MODE_THUMBS, MOD_NONE,  K_F3,        'create_thumbnails', False)
+@Shortcut(MODE_THUMBS, MOD_SHIFT, K_F3,        'cancel_thumbnails')
+@Shortcut(MODE_THUMBS, MOD_CTRL,  K_F3,        'upgrade_thumbnails')
 @Shortcut(MODE_THUMBS, MOD_NONE,  K_F4,        'filter_directory', 'Most items', '', 'X')
 @Shortcut(MODE_THUMBS, MOD_SHIFT, K_F4,        'filter_directory', 'All items', '', '')
 @Shortcut(MODE_THUMBS, MOD_CTRL,  tuple(range(K_a, K_z+1)), 'filter_browser', LETTER, LETTER, '')
@@ -48,14 +52,15 @@ class image_shortcuts(ShortcutSet):
 @Param('angle', int, 0)
 class rotate_marked(Command):
     def execute(self, directory, browser, angle):
-        for entry in browser.marked:
+        marked = list(browser.marked)
+        for entry in marked:
             entry.rotate(angle)
             entry.create_thumbnail(
                 basepath=directory.basepath,
                 block_size = browser.block_size,
-                border = browser.border,
-                override = True
+                border = browser.border
             )
+        directory.changed(*marked)
 
 @NeedsBrowser()
 class scroll_up_page(Command):
@@ -122,19 +127,80 @@ class filter_browser(Command):
         new_browser.name = name
         env.browser = new_browser
 
-@NeedsBrowser()
+@NeedsEnv()
+class find_duplicates(Command):
+    def execute(self, env):
+        directory = env.directory
+        unhashed = directory.unhashed_keys()
+        jobs = directory.settings.get('scan_jobs', 1)
+        print("Hashing %i files" % len(unhashed))
+        def hashed(digests, finished):
+            directory.apply_digests(digests)
+            if finished < len(unhashed):
+                pygame.display.set_caption("images - hashing %i/%i" % (finished, len(unhashed)))
+                return
+            pygame.display.set_caption("images")
+            groups = directory.duplicates()
+            print("Found %i sets of duplicates" % len(groups))
+            new_browser = create(directory, [key for keys in groups for key in keys])
+            new_browser.name = 'Duplicates'
+            env.browser = new_browser
+        # Hash in the background, the main loop stores each batch and shows the result
+        background.run_batches(unhashed, lambda keys: list(hash_files(directory.basepath, keys, jobs)),
+                               hashed, 'duplicates')
+
+@NeedsEnv()
+@Param('radius', int, 10)
+class similar(Command):
+    def execute(self, env, radius):
+        directory = env.directory
+        entry = env.browser.selected_image
+        if entry is None:
+            return
+        unhashed = directory.unphashed_keys()
+        jobs = directory.settings.get('scan_jobs', 1)
+        def hashed(phashes, finished):
+            directory.apply_phashes(phashes)
+            if finished < len(unhashed):
+                pygame.display.set_caption("images - hashing thumbnails %i/%i" % (finished, len(unhashed)))
+                return
+            pygame.display.set_caption("images")
+            found = directory.similar(entry.filename, radius)
+            print("Found %i images similar to %s" % (len(found), entry.filename))
+            new_browser = create(directory, [entry.filename] + [key for d, key in found])
+            new_browser.name = 'Similar to %s' % os.path.basename(entry.filename)
+            env.browser = new_browser
+        # Hash in the background, the main loop stores each batch and shows the result
+        background.run_batches(unhashed, lambda keys: directory.read_phashes(keys, jobs), hashed, 'similar')
+
+@NeedsEnv()
 @Param('override', bool, False)
 class create_thumbnails(Command):
-    def execute(self, browser, override):
-        browser.create_thumbs(override=override)
+    def execute(self, env, override):
+        settings = env.directory.settings
+        env.browser.create_thumbs(override=override, thumbnailer=env.thumbnailer,
+                                  source=settings.get('thumbnail_source', SOURCE_DECODE),
+                                  upgrade=settings.get('thumbnail_upgrade', True))
+
+@NeedsEnv()
+class upgrade_thumbnails(Command):
+    def execute(self, env):
+        env.browser.create_thumbs(thumbnailer=env.thumbnailer, source=SOURCE_DECODE, upgrade=True)
+
+@NeedsEnv()
+class cancel_thumbnails(Command):
+    def execute(self, env):
+        env.thumbnailer.cancel()
 
 @NeedsDirectory()
 @NeedsBrowser()
 @Param('category', str, 0)
 class toggle_category_marked(Command):
     def execute(self, directory, browser, category):
-        for entry in browser.marked:
+        marked = list(browser.marked)
+        for entry in marked:
             entry.toggle_category(category, directory)
+        directory.changed(*marked)
 
 @NeedsBrowser()
 @Param('filename', str, 'untitled')
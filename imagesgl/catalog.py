@@ -0,0 +1,155 @@
+#!/usr/bin/env python3
+
+import json
+import os
+import sqlite3
+from contextlib import contextmanager
+from imagesgl.directory import Directory
+from imagesgl.entry import Entry
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS entries (
+    key TEXT PRIMARY KEY,
+    type TEXT,
+    width INTEGER,
+    height INTEGER,
+    categories TEXT,
+    data TEXT
+);
+CREATE INDEX IF NOT EXISTS entries_type ON entries (type);
+CREATE INDEX IF NOT EXISTS entries_dimensions ON entries (width, height);
+CREATE TABLE IF NOT EXISTS categories (
+    category TEXT,
+    key TEXT,
+    PRIMARY KEY (category, key)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS categories_key ON categories (key);
+CREATE TABLE IF NOT EXISTS folders (
+    folder TEXT PRIMARY KEY,
+    mtime INTEGER,
+    subfolders TEXT
+);
+'''
+
+class SqliteDirectory(Directory):
+    '''A Directory that keeps its catalog in an SQLite database.
+
+    Every entry is a row with indexed columns for type and dimensions, and
+    its categories are rows in a separate indexed table. Additions, removals
+    and Directory.changed() are written right away in their own
+    transaction, so a crash loses at most the change in progress.
+    '''
+    def __init__(self, basepath):
+        Directory.__init__(self, basepath)
+        self.db = None
+        self._depth = 0
+
+    def __repr__(self):
+        return "<SqliteDirectory %s>" % self.basepath
+
+    def connect(self):
+        if self.db is None:
+            self.db = sqlite3.connect(self.directory_file)
+            self.db.execute('PRAGMA journal_mode=WAL')
+            self.db.execute('PRAGMA synchronous=NORMAL')
+            self.db.executescript(SCHEMA)
+        return self.db
+
+    @contextmanager
+    def transaction(self):
+        '''Group writes into one transaction, nested calls join the outer one.'''
+        db = self.connect()
+        self._depth += 1
+        try:
+            yield db
+        except:
+            self._depth -= 1
+            if self._depth == 0:
+                db.rollback()
+            raise
+        else:
+            self._depth -= 1
+            if self._depth == 0:
+                db.commit()
+
+    def open_journal(self):
+        # Every write is already its own transaction
+        pass
+
+    def close(self):
+        if not self.db is None:
+            self.db.close()
+            self.db = None
+
+    def _write(self, entries):
+        rows = []
+        categories = []
+        for entry in entries:
+            rows.append((entry.filename, entry.entry_type, entry.width, entry.height,
+                         entry.categories, json.dumps(entry.to_dict())))
+            categories.extend([(c, entry.filename) for c in entry.categories])
+        db = self.connect()
+        db.executemany('INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?, ?, ?)', rows)
+        db.executemany('DELETE FROM categories WHERE key = ?', [(row[0],) for row in rows])
+        db.executemany('INSERT OR IGNORE INTO categories VALUES (?, ?)', categories)
+
+    def __setitem__(self, key, entry):
+        Directory.__setitem__(self, key, entry)
+        with self.transaction():
+            self._write([entry])
+
+    def __delitem__(self, key):
+        Directory.__delitem__(self, key)
+        with self.transaction() as db:
+            db.execute('DELETE FROM entries WHERE key = ?', (key,))
+            db.execute('DELETE FROM categories WHERE key = ?', (key,))
+
+    def changed(self, *entries):
+        for entry in entries:
+            self.index(entry)
+        with self.transaction():
+            self._write(entries)
+
+    def apply_scan(self, result):
+        with self.transaction():
+            Directory.apply_scan(self, result)
+            self.save_folders()
+
+    def save(self, filename=None):
+        if filename and filename != self.directory_file:
+            self.close()
+        self.directory_file = filename or self.directory_file
+        # Entries that were never decoded cannot have changed
+        with self.transaction():
+            self._write([v for v in self.entries.values() if isinstance(v, Entry)])
+        self.save_folders()
+
+    def save_folders(self):
+        with self.transaction() as db:
+            db.execute('DELETE FROM folders')
+            db.executemany('INSERT INTO folders VALUES (?, ?, ?)',
+                [(f, m, json.dumps(s)) for f, (m, s) in self.folders.items()])
+
+    def load(self, filename=None):
+        if filename and filename != self.directory_file:
+            self.close()
+        self.directory_file = filename or self.directory_file
+        db = self.connect()
+        self.entries = {k: d for k, d in db.execute('SELECT key, data FROM entries ORDER BY key')}
+        self.unindex()
+        self.folders = {f: [m, json.loads(s)]
+                        for f, m, s in db.execute('SELECT folder, mtime, subfolders FROM folders')}
+
+    def migrate(self, json_file, filename=None):
+        '''Import a .directory.json catalog once and set the JSON file aside.'''
+        print("Migrating %s to SQLite" % json_file)
+        legacy = Directory(self.basepath)
+        legacy.load(json_file)
+        self.entries = {k: legacy[k] for k in legacy.keys()}
+        self.unindex()
+        self.folders = legacy.folders
+        self.save(filename)
+        for f in (json_file, legacy.folders_file, legacy.journal.filename, legacy.journal.compacting_file):
+            if os.path.exists(f):
+                os.rename(f, f + '.migrated')
+        print("Migrated %i entries" % len(self.entries))
@@ -0,0 +1,81 @@
+#!/usr/bin/env python3
+
+import math
+import pygame
+from PIL import Image
+
+# PIL raw modes and the pygame buffer formats with the same byte order
+_BUFFER_FORMATS = (('RGBX', 'RGBX'), ('RGB', 'RGB'), ('BGR', 'BGR'))
+
+# Transposes for quarter turns counter-clockwise, as pygame.transform.rotate turns
+_TRANSPOSES = {90: Image.ROTATE_90, 180: Image.ROTATE_180, 270: Image.ROTATE_270}
+
+_format = None
+
+def buffer_format():
+    '''Find how PIL should lay out pixels for pygame.
+
+    If one of the buffer formats is the pixel format of the display, a
+    surface made from it needs no conversion before it is blitted.
+    @return: tuple(rawmode, format, convert) - convert is True if no format matches
+    '''
+    global _format
+    display = pygame.display.get_surface()
+    if display is None:
+        return 'RGB', 'RGB', False
+    if _format is None or _format[0] != (display.get_bitsize(), display.get_masks()):
+        found = ('RGB', 'RGB', True)
+        for rawmode, fmt in _BUFFER_FORMATS:
+            try:
+                probe = pygame.image.frombuffer(bytes(len(fmt)), (1, 1), fmt)
+            except ValueError:
+                # Not every pygame knows every format, pygame 1.9 has no BGR
+                continue
+            if probe.get_bitsize() == display.get_bitsize() and probe.get_masks() == display.get_masks():
+                found = (rawmode, fmt, False)
+                break
+        _format = ((display.get_bitsize(), display.get_masks()), found)
+    return _format[1]
+
+def _has_alpha(im):
+    '''Whether a PIL image has transparent pixels, per pixel or by a transparent colour.'''
+    return im.mode in ('RGBA', 'LA', 'PA') or 'transparency' in im.info
+
+def to_surface(im):
+    '''Hand the pixels of a PIL image to pygame in the format of the display.
+
+    The surface shares the buffer PIL wrote the pixels into. Only if the
+    display uses none of the buffer formats, the surface is converted,
+    once here rather than on every blit. Images with transparency keep
+    it in a surface with per-pixel alpha.
+    '''
+    if _has_alpha(im):
+        if im.mode != 'RGBA':
+            im = im.convert('RGBA')
+        surface = pygame.image.frombuffer(im.tobytes(), im.size, 'RGBA')
+        return surface.convert_alpha() if not pygame.display.get_surface() is None else surface
+    rawmode, fmt, convert = buffer_format()
+    if im.mode != 'RGB':
+        im = im.convert('RGB')
+    surface = pygame.image.frombuffer(im.tobytes('raw', rawmode), im.size, fmt)
+    return surface.convert() if convert else surface
+
+def load(f, box=None, angle=0):
+    '''Decode an image into a Surface ready for the display.
+
+    Safe to call from worker threads.
+    @param f: str or file-like-object
+    @param box: tuple(width, height) - decode at the smallest scale libjpeg offers that still fills it
+    @param angle: int - turn the image counter-clockwise by a multiple of 90 degrees
+    @return: tuple(Surface, (width, height)) - the image and its full size before decoding and turning
+    '''
+    with Image.open(f) as im:
+        size = im.size
+        if not box is None:
+            iw, ih = size
+            scale = min(float(box[0]) / iw, float(box[1]) / ih, 1.0)
+            im.draft('RGB', (int(math.ceil(iw * scale)), int(math.ceil(ih * scale))))
+        im.load()
+        if angle % 360 in _TRANSPOSES:
+            im = im.transpose(_TRANSPOSES[angle % 360])
+        return to_surface(im), size
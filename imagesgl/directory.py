@@ -1,67 +1,505 @@
 #!/usr/bin/env python3
 
+import io
 import json
 import os
-from imagesgl.entry import Entry
+from concurrent.futures import ThreadPoolExecutor
+from imagesgl.entry import Entry, IMAGE, LETTERS, category_mask
+from imagesgl.journal import Journal
+from imagesgl.metadata import read_metadata
+from imagesgl.hashing import hash_files
+from imagesgl.similarity import BKTree, dhash, load_gray, distance
+from imagesgl.thumbpack import for_root, decode_pyramid
+
+def raw_field(raw, name):
+    '''Read one field of an entry that has not been decoded yet.
+
+    Only used for strings, numbers, flat lists and null, which is what
+    the category index and the scanners need.
+    @param raw: str or dict - the JSON text of an entry, or its dict
+    '''
+    if isinstance(raw, dict):
+        return raw.get(name)
+    tag = '"%s": ' % name
+    i = raw.find(tag)
+    if i == -1:
+        return None
+    i += len(tag)
+    if raw.startswith('"', i):
+        return raw[i+1:raw.index('"', i+1)]
+    if raw.startswith('[', i):
+        return json.loads(raw[i:raw.index(']', i)+1])
+    if raw.startswith('null', i):
+        return None
+    j = i
+    while j < len(raw) and raw[j] not in ',}':
+        j += 1
+    return json.loads(raw[i:j])
+
+def mask_of(entry):
+    '''The category mask of an entry, decoded or not.'''
+    if isinstance(entry, Entry):
+        return entry.category_mask
+    return category_mask(raw_field(entry, 'categories') or '')
+
+def build_index(items):
+    '''The keys in each category, from (key, entry) pairs.'''
+    index = [set() for c in LETTERS]
+    for key, entry in items:
+        mask = mask_of(entry)
+        if not mask:
+            continue
+        for i, keys in enumerate(index):
+            if mask >> i & 1:
+                keys.add(key)
+    return index
 
 class Directory:
+    '''The catalog of all files below basepath.
+
+    Entries are loaded lazily: self.entries maps keys to Entry objects,
+    or to the JSON text (or dict) they were read from until they are
+    first looked up with [].
+
+    The category index is built when it is first needed, or ahead of
+    that by read_index() and apply_index() while the main loop goes on.
+    '''
     def __init__(self, basepath):
         self.basepath = basepath
         self.entries = {}
+        self.category_index = [set() for c in LETTERS]
+        # Keys changed while the category index is being built
+        self._unindexed = None
         self.settings = {
             'export_dir': '~/Pictures',
             'extension_filter': ['jpg', 'jpeg', 'collection'],
+            'scan_jobs': 8,
+            'journal_compact_lines': 10000,
+            'thumbnail_cache': '~/.cache/images',
+            'thumbnail_cache_mb': 1024,
         }
+        self.folders = {}
+        self.similarity_index = None
+        self.phash_misses = {}
+        self.journal = None
         self.directory_file = None
         self.settings_file = None
 
     def __repr__(self):
         return "<Directory %s>" % self.basepath
 
+    def _postings(self, categories):
+        mask = category_mask(categories)
+        return [keys for i, keys in enumerate(self._index()) if mask >> i & 1]
+
+    def _index(self):
+        if self.category_index is None:
+            self.reindex()
+        return self.category_index
+
     def get_filtered(self, incl='', excl=''):
-        incl = incl.upper()
-        excl = excl.upper()
-        for k, entry in self.entries.items():
-            ok = True
-            for f in incl:
-                if not f in entry.categories:
-                    ok = False
-                    break
-            for f in excl:
-                if f in entry.categories:
-                    ok = False
-                    break
-            if ok: yield k, entry
+        for k in self._filtered_keys(incl, excl):
+            yield k, self[k]
+
+    def _filtered_keys(self, incl, excl):
+        excluded = set().union(*self._postings(excl))
+        included = sorted(self._postings(incl), key=len)
+        if included:
+            return included[0].intersection(*included[1:]) - excluded
+        elif excluded:
+            return [k for k in self.entries if not k in excluded]
+        else:
+            return list(self.entries)
+
+    def index(self, entry):
+        '''Bring the category index up to date for one entry.'''
+        key = entry.filename
+        if self.category_index is None:
+            self._unindexed.add(key)
+            return
+        mask = entry.category_mask
+        for i, keys in enumerate(self.category_index):
+            if mask >> i & 1:
+                keys.add(key)
+            else:
+                keys.discard(key)
+
+    def reindex(self):
+        self.category_index = build_index(self.entries.items())
+        self._unindexed = None
+
+    def unindex(self):
+        '''Drop the category index, it is built again when needed.'''
+        self.category_index = None
+        self._unindexed = set()
+
+    @property
+    def indexed(self):
+        return not self.category_index is None
+
+    def read_index(self):
+        '''Start building the category index of the entries as they are now.
+
+        Only the entries are taken here, on the main thread. The returned
+        function builds the index without touching the directory, so it
+        can run in the background; its result is put in place by
+        apply_index().
+        @return: function - returns the index
+        '''
+        items = list(self.entries.items())
+        return lambda: build_index(items)
+
+    def apply_index(self, index):
+        '''Put an index from read_index() in place, unless one was built meanwhile.
+
+        Entries added, changed or removed since read_index() are indexed
+        again.
+        @return: boolean - whether the index was used
+        '''
+        if self.indexed:
+            return False
+        for key in self._unindexed:
+            for keys in index:
+                keys.discard(key)
+            mask = mask_of(self.entries[key]) if key in self.entries else 0
+            for i, keys in enumerate(index):
+                if mask >> i & 1:
+                    keys.add(key)
+        self.category_index = index
+        self._unindexed = None
+        return True
+
+    def category_counts(self):
+        return {c: len(keys) for c, keys in zip(LETTERS, self._index()) if keys}
 
     def get_filtered_keys(self, incl='', excl=''):
-        incl = incl.upper()
-        excl = excl.upper()
-        for k, entry in self.get_filtered(incl=incl, excl=excl):
+        for k in self._filtered_keys(incl, excl):
             yield k
 
     def __setitem__(self, key, entry):
         print("Adding %s" % key)
         self.entries[key] = entry
+        self.index(entry)
+        if not self.journal is None:
+            self.journal.append(key, entry.to_dict())
+
+    def __delitem__(self, key):
+        print("Removing %s" % key)
+        del self.entries[key]
+        if self.category_index is None:
+            self._unindexed.add(key)
+        for keys in self.category_index or []:
+            keys.discard(key)
+        if not self.journal is None:
+            self.journal.append(key, None)
 
     def __getitem__(self, key):
-        return self.entries.get(key)
+        entry = self.entries.get(key)
+        if entry is None or isinstance(entry, Entry):
+            return entry
+        entry = Entry(from_dict=json.loads(entry) if isinstance(entry, str) else entry)
+        self.entries[key] = entry
+        return entry
+
+    def stat_of(self, key):
+        '''The (size, mtime, inode) of a file without decoding its entry.'''
+        entry = self.entries.get(key)
+        stat = entry.stat if isinstance(entry, Entry) else raw_field(entry, 'stat')
+        return tuple(stat) if stat else None
 
     def __contains__(self, key):
         return key in self.entries
 
+    def changed(self, *entries):
+        '''Called after the persistent fields of entries have been modified.'''
+        for entry in entries:
+            self.index(entry)
+        if self.journal is None:
+            return
+        for entry in entries:
+            self.journal.append(entry.filename, entry.to_dict())
+        self.journal.sync()
+
+    def keys(self):
+        return self.entries.keys()
+
     def __iter__(self):
-        for key, entry in self.entries.items():
-            yield entry
+        for key in list(self.entries.keys()):
+            yield self[key]
+
+    def raw_entries(self):
+        '''Entry dicts or JSON text for all entries, without decoding any.'''
+        return {k: v.to_dict() if isinstance(v, Entry) else v for k, v in self.entries.items()}
+
+    @property
+    def folders_file(self):
+        return os.path.join(os.path.dirname(self.directory_file), '.folders.json')
+
+    def open_journal(self):
+        self.journal = Journal(self.directory_file,
+            compact_lines=int(self.settings.get('journal_compact_lines', 10000)))
 
     def save(self, filename=None):
-        self.directory_file = filename or self.directory_file
-        with open(self.directory_file, 'w') as f:
-            f.write(json.dumps({k: v.to_dict() for k, v in self.entries.items()}, indent=2))
+        '''Make all changes durable.
+
+        Changes are journalled as they are made and merged into the
+        snapshot by compaction, so this only waits for a running
+        compaction and flushes the journal. A complete snapshot is
+        written when saving to another file.
+        '''
+        if filename and filename != self.directory_file:
+            self.directory_file = filename
+            self.open_journal()
+            self.journal.checkpoint(self.raw_entries())
+        elif self.journal is None:
+            self.open_journal()
+            self.journal.checkpoint(self.raw_entries())
+        else:
+            self.journal.wait()
+            self.journal.sync()
+            self.journal.close()
+        with open(self.folders_file, 'w') as f:
+            f.write(json.dumps(self.folders))
 
     def load(self, filename=None):
+        '''Load the last snapshot and replay the journal on top of it.
+        Entries are decoded on first access and the category index is
+        built when first needed. A missing snapshot is an empty directory.
+        '''
         self.directory_file = filename or self.directory_file
-        with open(self.directory_file, 'r') as f:
-            self.entries = {k: Entry(from_dict=v) for k, v in json.load(f).items()}
+        self.open_journal()
+        self.entries = self.journal.load()
+        self.unindex()
+        if os.path.exists(self.folders_file):
+            with open(self.folders_file, 'r') as f:
+                self.folders = json.load(f)
+
+    def scan(self, scanner, full=False):
+        known = {k: self.stat_of(k) for k in self.entries}
+        result = scanner.scan_incremental(self.folders, known, full=full)
+        self.apply_scan(result)
+        return result
+
+    def sync(self):
+        if not self.journal is None:
+            self.journal.sync()
+
+    def unscanned_keys(self):
+        '''Keys of images whose headers have not been read yet, without decoding entries.'''
+        keys = []
+        for key, entry in self.entries.items():
+            if isinstance(entry, Entry):
+                if entry.entry_type == IMAGE and entry.orientation is None:
+                    keys.append(key)
+            elif raw_field(entry, 'orientation') is None and raw_field(entry, 'type') in (IMAGE, None):
+                keys.append(key)
+        return sorted(keys)
+
+    def scan_metadata(self, keys, jobs=1):
+        '''Read the headers of the given files on a pool of jobs threads.
+        @return: list - the entries that were scanned
+        '''
+        return self.apply_headers(self.read_headers(keys, jobs))
+
+    def read_headers(self, keys, jobs=1):
+        '''Read the headers of the given files on a pool of jobs threads.
+
+        Only the files are read, no entry is touched, so this can run in
+        the background while the main loop goes on. The result is stored
+        by apply_headers().
+        @return: list of tuple(key, metadata or None)
+        '''
+        def work(key):
+            try:
+                return key, read_metadata(os.path.join(self.basepath, key))
+            except OSError:
+                return key, None
+        with ThreadPoolExecutor(max_workers=max(1, int(jobs))) as pool:
+            return list(pool.map(work, keys))
+
+    def apply_headers(self, headers):
+        '''Store headers returned by read_headers() in the entries that are still images.
+        @return: list - the entries that were scanned
+        '''
+        entries = []
+        for key, metadata in headers:
+            if key in self and self[key].entry_type == IMAGE:
+                self[key].apply_metadata(metadata)
+                entries.append(self[key])
+        self.changed(*entries)
+        return entries
+
+    def digest_of(self, key):
+        '''The content digest of a file if it was hashed since it last changed.'''
+        entry = self.entries.get(key)
+        digest = entry.digest if isinstance(entry, Entry) else raw_field(entry, 'digest')
+        stat = self.stat_of(key)
+        if not digest or (stat and tuple(stat[:2]) != tuple(digest[:2])):
+            return None
+        return digest[2]
+
+    def unhashed_keys(self):
+        keys = [key for key in self.entries if self.digest_of(key) is None]
+        return sorted(keys)
+
+    def hash_entries(self, keys, jobs=1):
+        '''Hash the contents of the given files on a pool of jobs threads.
+        Files that cannot be read are skipped.
+        @return: int - the number of files hashed
+        '''
+        n = 0
+        # Store as we go, so an interrupted run does not start over
+        for start in range(0, len(keys), 1000):
+            n += len(self.apply_digests(hash_files(self.basepath, keys[start:start+1000], jobs)))
+            print("Hashed %i of %i files" % (n, len(keys)))
+        return n
+
+    def apply_digests(self, digests):
+        '''Store digests made by hash_files() in the entries, skipping unreadable files.
+        @return: list - the entries that were hashed
+        '''
+        hashed = []
+        for key, digest in digests:
+            if digest is None or not key in self:
+                continue
+            entry = self[key]
+            entry.digest = digest
+            hashed.append(entry)
+        self.changed(*hashed)
+        return hashed
+
+    def duplicates(self):
+        '''Groups of files with the same contents, from the cached digests.
+        @return: list of sorted lists of keys, ordered by their first key
+        '''
+        groups = {}
+        for key in self.entries:
+            digest = self.digest_of(key)
+            if not digest is None:
+                groups.setdefault(digest, []).append(key)
+        return sorted([sorted(keys) for keys in groups.values() if len(keys) > 1])
+
+    def phash_of(self, key):
+        entry = self.entries.get(key)
+        return entry.phash if isinstance(entry, Entry) else raw_field(entry, 'phash')
+
+    def unphashed_keys(self):
+        '''Keys without a perceptual hash, except those that failed and still have the same thumbnails.'''
+        pack = for_root(self.basepath)
+        return sorted([key for key in self.entries if self.phash_of(key) is None
+                       and (not key in self.phash_misses or self.phash_misses[key] != pack.location(key))])
+
+    def phash_entries(self, keys, jobs=1):
+        '''Compute perceptual hashes from the thumbnails of the given files.
+
+        Files without a thumbnail are skipped.
+        @return: int - the number of files hashed
+        '''
+        n = 0
+        for start in range(0, len(keys), 1000):
+            n += len(self.apply_phashes(self.read_phashes(keys[start:start+1000], jobs)))
+            print("Hashed %i thumbnails" % n)
+        return n
+
+    def read_phashes(self, keys, jobs=1):
+        '''Compute perceptual hashes from the thumbnails of the given files.
+
+        Thumbnails are read and shrunk on a pool of jobs threads, the hashes
+        are computed in one go. No entry is touched, so this can run in the
+        background; the result is stored by apply_phashes().
+        @return: list of tuple(key, location of the thumbnails, hash or None)
+        '''
+        pack = for_root(self.basepath)
+        def work(key):
+            location = pack.location(key)
+            data = pack.get(key)
+            if data is None:
+                return key, location, None
+            pyramid = decode_pyramid(data)
+            if not pyramid is None:
+                # The square thumbnail is unrotated and shows the whole middle of the image
+                data = pyramid[2].get((1, 1))
+                if data is None:
+                    return key, location, None
+            try:
+                return key, location, load_gray(io.BytesIO(data))
+            except (OSError, ValueError):
+                return key, location, None
+        with ThreadPoolExecutor(max_workers=max(1, int(jobs))) as pool:
+            loaded = list(pool.map(work, keys))
+        grays = [(k, g) for k, l, g in loaded if not g is None]
+        hashes = dict(zip([k for k, g in grays], dhash([g for k, g in grays]))) if grays else {}
+        return [(k, l, hashes.get(k)) for k, l, g in loaded]
+
+    def apply_phashes(self, phashes):
+        '''Store hashes made by read_phashes() in the entries.
+
+        Files that could not be hashed are remembered with the location of
+        their thumbnails, and only tried again once those are replaced.
+        @return: list - the entries that were hashed
+        '''
+        entries = []
+        for key, location, h in phashes:
+            if not key in self:
+                continue
+            if h is None:
+                self.phash_misses[key] = location
+                continue
+            self.phash_misses.pop(key, None)
+            entry = self[key]
+            entry.phash = h
+            if not self.similarity_index is None:
+                self.similarity_index.add(h, entry.filename)
+            entries.append(entry)
+        self.changed(*entries)
+        return entries
+
+    def similar(self, key, radius=10):
+        '''Find files that look like key, using a BK-tree built on first use.
+        @return: list of tuple(distance, key), nearest first, key itself excluded
+        '''
+        h = self.phash_of(key)
+        if h is None:
+            return []
+        if self.similarity_index is None:
+            self.similarity_index = BKTree()
+            for k in self.entries:
+                kh = self.phash_of(k)
+                if not kh is None:
+                    self.similarity_index.add(kh, k)
+        result = []
+        for d, k in self.similarity_index.search(h, radius):
+            # The tree is not pruned, skip keys that are gone or were hashed again
+            kh = self.phash_of(k) if k in self else None
+            if k != key and not kh is None and distance(h, kh) == d:
+                result.append((d, k))
+        return result
+
+    def apply_scan(self, result):
+        for old, new in result.moved:
+            if not old in self:
+                continue
+            entry = self[old]
+            del self[old]
+            entry.rename(new, self.basepath)
+            self[new] = entry
+        for key in result.removed:
+            if key in self:
+                del self[key]
+        for key in result.changed:
+            entry = self[key]
+            print("Changed file", key)
+            entry.invalidate(self.basepath)
+        for key in result.added:
+            entry = Entry(key)
+            entry.categories = 'N'
+            entry.stat = result.stats.get(key)
+            self[key] = entry
+            print("Added new file", key)
+        updated = [key for key in result.stats if not key in result.added]
+        for key in updated:
+            self[key].stat = result.stats[key]
+        self.changed(*[self[key] for key in updated])
 
     def save_settings(self, filename=None):
         self.settings_file = filename or self.settings_file
@@ -80,5 +518,5 @@ class Directory:
             entry.delete_from_disk(self.basepath)
             deleted.append(k)
         for k in deleted:
-            del self.entries[k]
+            del self[k]
         return deleted
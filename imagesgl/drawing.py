@@ -63,29 +63,38 @@ def draw_thumbs(win, browser):
     win.blit(title, titleRect)
 
 def draw_image(win, image, show_info=False, catmap={}):
-    win.blit(image.zoomed or image.original, image.position(pygame.display.get_surface().get_size()))
+    image.draw(win)
     if show_info:
-        info_text = entry.filename + '\n'
+        lines = [image.filename, '']
         if image.categories:
-            info_text += "\n[Categories]\n"
-            for category in image.category:
-                info_text += '%s - %s\n' % (
+            lines.append("[Categories]")
+            for category in image.categories:
+                lines.append('%s - %s' % (
                     category,
                     catmap.get(category, {}).get('name', '?'),
-                )
-        info_text += "\n[Properties]\n"
-        info_text += "Dimensions: (%i, %i)\n" % (entry.width, entry.height)
-        info_text += "Thumb tiles: (%i, %i)\n" % (entry.thumb_width, entry.thumb_height)
-        info_text += "Angle: %i\n" % entry.angle
-        info_text += "Marked: %si\n" % 'Yes' if entry.marked else 'No'
-        info_text += "\n[Comment]\n"
-        info_text += entry.comment
-        info = mainFont.render(info_text, False, COLOR_TEXT)
-        infoRect = cats.get_rect()
-        infoRect.topleft = (2, 2)
+                ))
+            lines.append('')
+        lines.append("[Properties]")
+        lines.append("Dimensions: (%i, %i)" % (image.width, image.height))
+        lines.append("Taken: %s" % (image.taken or '?'))
+        lines.append("Camera: %s" % (image.camera or '?'))
+        lines.append("Thumb tiles: (%i, %i)" % image.thumb_size)
+        lines.append("Angle: %i" % image.angle)
+        lines.append("Marked: %s" % ('Yes' if image.marked else 'No'))
+        if image.comment:
+            lines.append('')
+            lines.append("[Comment]")
+            lines.append(image.comment)
+        # Fonts render a single line, so the panel is drawn line by line
+        infos = [mainFont.render(line, False, COLOR_TEXT) for line in lines]
         pygame.draw.rect(pygame.display.get_surface(), COLOR_TEXT_BACK,
-            (0, 0, info.get_width() + 4, info.get_height() + 4))
-        win.blit(info, infoRect)
+            (0, 0, max([info.get_width() for info in infos]) + 4, sum([info.get_height() for info in infos]) + 4))
+        y = 2
+        for info in infos:
+            infoRect = info.get_rect()
+            infoRect.topleft = (2, y)
+            win.blit(info, infoRect)
+            y += info.get_height()
 
 def draw_input_box(win, inputbox):
     title = mainFont.render(inputbox.display, False, COLOR_TEXT)
@@ -1,31 +1,104 @@
 #!/usr/bin/env python3
 
 import pygame
+import io
 import os
-import threading
 from PIL import Image
 from math import pi
+from collections import OrderedDict
+from imagesgl.metadata import read_metadata
+from imagesgl.thumbnailer import Job, THUMB_SHAPES, SOURCE_DECODE, make_pyramid, resize, thumbnail_box
+from imagesgl.thumbpack import for_root, decode_pyramid
+from imagesgl.tiles import TiledImage
+from imagesgl import thumbcache, loader, imagecache, decode
 
 IMAGE = 'image'
 COLLECTION = 'collection'
 NOTE = 'note'
 
+LETTERS = 'ABCDEFGHIJKLMNOPQRSTUVWXYZ'
+
+def category_mask(categories):
+    '''Turn a string of category letters into a 26 bit mask.'''
+    mask = 0
+    for c in categories.upper():
+        i = ord(c) - 65
+        if 0 <= i < 26:
+            mask |= 1 << i
+    return mask
+
+def category_letters(mask):
+    '''Turn a category mask back into a sorted string of letters.'''
+    return ''.join([c for i, c in enumerate(LETTERS) if mask >> i & 1])
+
+_thumb_sizes = {}
+
+def thumb_size_of(size):
+    '''Share one tuple per thumbnail size between all entries.'''
+    size = tuple(size)
+    return _thumb_sizes.setdefault(size, size)
+
+# Memory for the turned images and tiles a view keeps, the current angle is always kept
+TURNS_MAX_BYTES = 64 << 20
+
+class View:
+    '''Display state of an image that is loaded for viewing.
+
+    The original may be smaller than the image: resolution is its scale
+    relative to the full image, and scale is always relative to the full
+    image. A placeholder is a thumbnail shown until the image is decoded.
+    The original is drawn through a TiledImage per angle, which only
+    resamples the part in view and keeps the tiles of recent scales. The
+    TiledImages of earlier angles are kept for turning back, as long as
+    they fit in TURNS_MAX_BYTES.
+    '''
+    __slots__ = ('original', 'turns', 'scale', 'x', 'y', 'resolution', 'placeholder')
+
+    def __init__(self, original, resolution=1.0, placeholder=False):
+        self.original = original
+        self.turns = OrderedDict()
+        self.scale = 1.0
+        self.x, self.y = 0, 0
+        self.resolution = resolution
+        self.placeholder = placeholder
+
+    def tiles(self, angle):
+        '''The TiledImage of the original turned by angle.'''
+        tiled = self.turns.pop(angle, None)
+        if tiled is None:
+            tiled = TiledImage(self.original, angle)
+        self.turns[angle] = tiled
+        while len(self.turns) > 1 and sum([t.bytes for t in self.turns.values()]) > TURNS_MAX_BYTES:
+            self.turns.popitem(last=False)
+        return tiled
+
 class Entry:
+    '''Catalog metadata of one file.
+
+    Entries are kept for every file in the catalog, so only persistent
+    fields are stored here, in slots. Surfaces and zoom/pan state of an
+    image being viewed live in a View that exists while it is loaded.
+    '''
+    __slots__ = ('filename', 'category_mask', 'angle', 'width', 'height', 'comment',
+                 'stat', 'digest', 'phash', 'orientation', 'taken', 'camera', 'thumb_size', 'entry_type',
+                 'name', 'scanned', 'marked', 'thumbnail', 'view')
+
     def __init__(self, filename=None, from_dict=None):
         self.filename = filename
-        self.filename_thumb = str(self.filename) + '.thumbnail'
-        self.categories = ""
+        self.category_mask = 0
         self.angle = 0
         self.height = 0
         self.width = 0
-        self.height_thumb = 0
-        self.width_thumb = 0
         self.comment = None
-        self.original = None
+        self.stat = None # (size, mtime, inode) from the last scan
+        self.digest = None # (size, mtime, hex digest) of the contents when hashed
+        self.phash = None # perceptual hash of the thumbnail
+        self.orientation = None # EXIF orientation, None until the headers are read
+        self.taken = None
+        self.camera = None
         self.thumbnail = None
+        self.view = None
         self.scanned = False
-        self.loaded = False
-        self.loaded_thumb = False
         self.marked = False
         self.thumb_size = (1, 1) # in blocks
         if filename and filename.endswith('.collection'):
@@ -34,12 +107,7 @@ class Entry:
             self.entry_type = NOTE
         else:
             self.entry_type = IMAGE
-        self.content = None
         self.name = None
-        
-        self.scale = 1.0
-        self.zoomed = None
-        self.x, self.y = 0, 0
         if not from_dict is None:
             #print(from_dict)
             self.from_dict(from_dict)
@@ -47,36 +115,157 @@ class Entry:
     def __repr__(self):
         return "<Entry %s>" % self.filename
 
-    def load_thumbnail(self, basepath=None, callback=None):
-        thumb_filename = os.path.join(basepath, self.filename_thumb)
-        if not os.path.exists(thumb_filename):
+    @property
+    def categories(self):
+        return category_letters(self.category_mask)
+
+    @categories.setter
+    def categories(self, categories):
+        self.category_mask = category_mask(categories)
+
+    def has_category(self, category):
+        return bool(self.category_mask & category_mask(category))
+
+    @property
+    def loaded_thumb(self):
+        return not self.thumbnail is None
+
+    @property
+    def width_thumb(self):
+        return self.thumbnail.get_width() if not self.thumbnail is None else 0
+
+    @property
+    def height_thumb(self):
+        return self.thumbnail.get_height() if not self.thumbnail is None else 0
+
+    @property
+    def loaded(self):
+        return not self.view is None
+
+    @property
+    def decoded(self):
+        return not self.view is None and not self.view.placeholder
+
+    @property
+    def needs_full(self):
+        '''Whether the view is zoomed past the resolution the image was decoded at.'''
+        view = self.view
+        return not view is None and not view.placeholder and view.scale > view.resolution * 1.01
+
+    @property
+    def original(self):
+        return self.view.original if not self.view is None else None
+
+    def read_thumbnail(self, basepath=None, block_size=None, border=0):
+        '''Decode the thumbnail of the current shape and angle from the pack of basepath.
+
+        Thumbnails are stored unrotated in all shapes, so a new shape or
+        angle only needs a lookup. If the pack has none but the shared cache
+        has thumbnails of the same contents, those are copied into the pack.
+        With block_size, a thumbnail made for a larger block size is scaled.
+        Safe to call from worker threads, the entry is not changed.
+        @return: Surface - or None if there is no thumbnail
+        '''
+        pack = for_root(basepath)
+        data = pack.get(self.filename)
+        if data is None and not block_size is None:
+            data = self._cached_thumbnail(basepath, block_size, border)
+            if not data is None:
+                pack.put(self.filename, data)
+        if data is None:
+            return None
+        return self._thumbnail_surface(data, block_size, border)
+
+    def load_thumbnail(self, basepath=None, block_size=None, border=0):
+        '''Read the thumbnail, see read_thumbnail, and show it.'''
+        thumbnail = self.read_thumbnail(basepath, block_size, border)
+        if thumbnail is None:
             return
-        self.thumbnail = pygame.image.load(thumb_filename)
-        self.width_thumb, self.height_thumb = self.thumbnail.get_size()
-        self.loaded_thumb = True
-        if not callback is None:
-            callback()
+        self.thumbnail = thumbnail
+
+    def _thumbnail_surface(self, data, block_size, border):
+        pyramid = decode_pyramid(data)
+        if pyramid is None:
+            # A single thumbnail from before pyramids, already cropped and rotated
+            return decode.load(io.BytesIO(data))[0]
+        stored_size, stored_border, images = pyramid
+        shape = self.stored_shape
+        if not shape in images:
+            return None
+        if block_size is None or (block_size, border) == (stored_size, stored_border):
+            return decode.load(io.BytesIO(images[shape]), angle=self.angle)[0]
+        # Let libjpeg skip what a smaller block size does not need
+        box = self.thumbnail_box(block_size, border)
+        thumbnail = decode.load(io.BytesIO(images[shape]), box if self.angle % 180 == 0 else box[::-1], self.angle)[0]
+        if thumbnail.get_size() != box:
+            thumbnail = pygame.transform.smoothscale(thumbnail, box)
+        return thumbnail
 
-    def create_thumbnail(self, basepath, block_size, border=0, override=False):
+    def _cached_thumbnail(self, basepath, block_size, border):
+        cache = thumbcache.shared()
+        if cache is None:
+            return None
         infile = os.path.join(basepath, self.filename)
-        outfile = os.path.join(basepath, self.filename_thumb)
-        print("Creating thumbnail for", infile)
-        if os.path.exists(outfile) and not override:
-            print("Thumbnail already exists")
+        # Remember misses, the grid asks again every frame until the thumbnail is created
+        miss = (infile, block_size, border)
+        if miss in cache.misses:
+            return None
+        try:
+            data = cache.get(cache.key(infile, block_size, border))
+        except OSError:
+            data = None
+        if data is None:
+            cache.misses.add(miss)
+        return data
+
+    @property
+    def stored_shape(self):
+        '''The shape of the unrotated thumbnail that is shown rotated.'''
+        tw, th = self.thumb_size
+        return (th, tw) if self.angle % 180 == 90 else (tw, th)
+
+    def thumbnail_shapes(self):
+        tw, th = self.thumb_size
+        return set(THUMB_SHAPES) | set([(tw, th), (th, tw)])
+
+    def thumbnail_box(self, block_size, border=0):
+        return thumbnail_box(self.thumb_size, block_size, border)
+
+    def has_thumbnail(self, basepath, block_size, border=0, full=False):
+        '''Whether the pack has a thumbnail of this shape, at least as large as block_size.
+        @param full: boolean - only count thumbnails made from the image, not from an embedded preview
+        '''
+        header = for_root(basepath).header(self.filename)
+        if header is None or (full and header.get('preview')):
+            return False
+        shapes = [(w, h) for w, h, o, l in header['sizes']]
+        return header['block_size'] >= block_size and self.stored_shape in shapes
+
+    def thumbnail_job(self, basepath, block_size, border=0, source=SOURCE_DECODE):
+        return Job(self.filename, os.path.join(basepath, self.filename),
+                   self.thumbnail_shapes(), block_size, border, for_root(basepath), source)
+
+    def create_thumbnail(self, basepath, block_size, border=0, override=False, source=SOURCE_DECODE):
+        '''Make the thumbnails of all shapes, unless there are usable ones already.
+        Then load the one of the current shape and angle.
+        @param source: str - SOURCE_PREVIEW to use an embedded preview when it is large enough
+        '''
+        infile = os.path.join(basepath, self.filename)
+        if not override and self.has_thumbnail(basepath, block_size, border):
+            self.load_thumbnail(basepath, block_size=block_size, border=border)
             return
+        print("Creating thumbnail for", infile)
         try:
-            im = Image.open(infile)
-            with open(outfile, 'w') as out:
-                tw, th = self.thumb_size
-                w = block_size * tw + border * (tw - 1) * 2 
-                h = block_size * th + border * (th - 1) * 2 
-                self._resize(im, (w, h), True, out)
-                self.load_thumbnail(basepath)
-                print("Created thumbnail", outfile)
+            data = make_pyramid(infile, block_size, border, self.thumbnail_shapes(), source)
         except ValueError:
             print("Cannot create thumbnail for '%s' (ValueError)" % infile)
+            return
         except OSError:
             print("Cannot create thumbnail for '%s' (OSError)" % infile)
+            return
+        for_root(basepath).put(self.filename, data)
+        self.load_thumbnail(basepath, block_size=block_size, border=border)
+        print("Created thumbnail", infile)
         
     def export(self, basepath, longest_edge, output_dir, output_filename):
         infile = os.path.join(basepath, self.filename)
@@ -85,7 +274,7 @@ class Entry:
         print("Exporting image", infile, "to", outfile)
         try:
             im = Image.open(infile)
-            with open(outfile, 'w') as out:
+            with open(outfile, 'wb') as out:
                 self.width, self.height = im.size
                 if self.width > self.height:
                     scale = float(longest_edge) / float(self.width)
@@ -93,7 +282,7 @@ class Entry:
                     scale = float(longest_edge) / float(self.height)
                 w = int(self.width * scale)
                 h = int(self.height * scale)
-                self._resize(im, (w, h), False, out)
+                resize(im, (w, h), False, self.angle, out)
                 print("Created image", outfile)
         except ValueError:
             print("Cannot export '%s' -> '%s' (ValueError)" % (infile, outfile))
@@ -101,13 +290,20 @@ class Entry:
             print("Cannot export '%s' -> '%s' (OSError)" % (infile, outfile))
 
     def to_dict(self):
+        # the fields up to orientation are read without decoding the rest
         return {
-            'filename': self.filename,
             'categories': self.categories,
+            'stat': self.stat,
+            'digest': self.digest,
+            'phash': self.phash,
+            'orientation': self.orientation,
+            'filename': self.filename,
             'angle': self.angle,
             'height': self.height,
             'width': self.width,
             'comment': self.comment,
+            'taken': self.taken,
+            'camera': self.camera,
             'thumb_size': self.thumb_size,
             'type': self.entry_type,
             'name': self.name,
@@ -115,101 +311,174 @@ class Entry:
 
     def from_dict(self, d):
         self.filename = d.get('filename', '')
-        self.filename_thumb = self.filename + '.thumbnail'
         self.categories = d.get('categories', "")
         self.angle = d.get('angle', 0)
         self.height = d.get('height', 0)
         self.width = d.get('width', 0)
         self.comment = d.get('comment', None)
-        self.thumb_size = d.get('thumb_size', (1, 1))
+        self.thumb_size = thumb_size_of(d.get('thumb_size', (1, 1)))
         self.entry_type = d.get('type', IMAGE)
         self.name = d.get('name', None)
+        stat = d.get('stat', None)
+        self.stat = tuple(stat) if stat else None
+        digest = d.get('digest', None)
+        self.digest = tuple(digest) if digest else None
+        self.phash = d.get('phash', None)
+        self.orientation = d.get('orientation', None)
+        self.taken = d.get('taken', None)
+        self.camera = d.get('camera', None)
 
-    def load_image(self, basepath=None, callback=None, winsize=None):
-        if self.entry_type != IMAGE:
-            return
-        print("Thread loading", "without callback" if callback is None else "with callback")
-        self.original = pygame.image.load(os.path.join(basepath, self.filename))
-        self.width, self.height = self.original.get_size()
-        self.loaded = True
-        if not winsize is None:
+    def read_image(self, basepath, winsize=None):
+        '''Decode the image for viewing, without changing the entry.
+
+        With winsize it is decoded just large enough to fit the window,
+        without at full resolution. Safe to call from worker threads.
+        @return: tuple(Surface, (width, height)) - the decoded image and its full size
+        '''
+        infile = os.path.join(basepath, self.filename)
+        if winsize is None:
+            return decode.load(infile)
+        ww, wh = winsize
+        return decode.load(infile, (ww, wh) if self.angle % 180 == 0 else (wh, ww))
+
+    def show_image(self, original, size, winsize=None):
+        '''View a decoded image, zoomed to fit winsize or else at the zoom and position of the current view.'''
+        self.width, self.height = size
+        if winsize is None:
+            view = View(original)
+            old = self.view
+            if not old is None and not old.placeholder:
+                view.scale, view.x, view.y = old.scale, old.x, old.y
+            self.view = view
+            self.zoom(1)
+        else:
+            self.view = View(original, float(original.get_width()) / self.width)
             self.zoom_fit(winsize)
-        if not callback is None:
-            print("Thread Callback")
-            callback()
-        print("Thread Done")
+        imagecache.shared().add(self)
+
+    def load_placeholder(self, basepath, winsize):
+        '''Show the thumbnail scaled up until the image is decoded.
+
+        The thumbnail shape closest to the aspect ratio of the image is
+        stretched to it, which is close enough for a moment.
+        '''
+        if self.entry_type != IMAGE or not self.width or not self.height:
+            return
+        data = for_root(basepath).get(self.filename)
+        pyramid = decode_pyramid(data) if not data is None else None
+        if pyramid is None:
+            return
+        images = pyramid[2]
+        aspect = float(self.width) / self.height
+        shape = min(images.keys(), key=lambda s: abs(float(s[0]) / s[1] - aspect))
+        thumbnail = decode.load(io.BytesIO(images[shape]))[0]
+        resolution = float(thumbnail.get_width()) / self.width
+        size = (max(1, int(self.width * resolution)), max(1, int(self.height * resolution)))
+        self.view = View(pygame.transform.smoothscale(thumbnail, size), resolution, placeholder=True)
+        self.zoom_fit(winsize)
 
-    def load_image_threaded(self, basepath, callback, winsize=None):
+    def load_image_threaded(self, basepath, winsize=None):
+        '''Decode the image on the shared loader, it is viewed when the main loop applies the result.
+        See read_image for winsize.
+        '''
         if self.entry_type != IMAGE:
             return
-        print("Loading", "without callback" if callback is None else "with callback")
-        t = threading.Thread(target=self.load_image, kwargs={'basepath': basepath, 'callback': callback, 'winsize': winsize})
-        t.daemon = True
-        t.start()
+        print("Loading", self.filename, "at full resolution" if winsize is None else "to fit the window")
+        def work():
+            original, size = self.read_image(basepath, winsize)
+            def apply():
+                # A full resolution view that came in first stays
+                if not winsize is None and self.decoded:
+                    return
+                self.show_image(original, size, winsize)
+            return apply
+        loader.shared().request((IMAGE, self.filename, winsize is None), work, IMAGE)
 
-    def load_thumbnail_threaded(self, basepath, callback):
-        t = threading.Thread(target=self.load_thumbnail, kwargs={'basepath': basepath, 'callback': callback})
-        t.daemon = True
-        t.start()
+    def load_thumbnail_threaded(self, basepath, block_size=None, border=0):
+        '''Decode the thumbnail on the shared loader, it is shown when the main loop applies the result.'''
+        def work():
+            shape = (self.angle, self.thumb_size)
+            thumbnail = self.read_thumbnail(basepath, block_size, border)
+            if thumbnail is None:
+                return None
+            def apply():
+                # Rotated or reshaped while it was read
+                if (self.angle, self.thumb_size) == shape:
+                    self.thumbnail = thumbnail
+            return apply
+        loader.shared().request(('thumbnail', self.filename), work, 'thumbnail')
 
     def zoom_fit(self, winsize):
+        if self.view is None:
+            return
         ww, wh = winsize
-        self.scale = min(ww / self.width, wh / self.height) if self.angle in (0, 180) else min( ww / self.height, wh / self.width)
+        self.view.scale = min(ww / self.width, wh / self.height) if self.angle in (0, 180) else min( ww / self.height, wh / self.width)
         self.zoom(1)
     
     def zoom_0(self):
-        self.scale = 1
+        if self.view is None:
+            return
+        self.view.scale = 1
         self.zoom(1)
     
     def zoom_to(self, scale):
-        self.scale = scale 
+        if self.view is None:
+            return
+        self.view.scale = scale 
         self.zoom(1)
     
     def zoom(self, factor):
-        self.scale *= factor
-        try:
-            print("ZOOM: %f %f" % (self.angle, self.scale))
-            self.zoomed = pygame.transform.rotozoom(self.original, self.angle, self.scale)
-        except pygame.error:
-            self.scale /= factor
-        except TypeError:
-            self.scale /= factor
+        view = self.view
+        if view is None:
+            return
+        view.scale *= factor
+        print("ZOOM: %f %f" % (self.angle, view.scale))
+
+    def draw(self, win):
+        '''Draw the part of the image that is in the window.'''
+        view = self.view
+        if view is None:
+            return
+        view.tiles(self.angle).draw(win, view.scale / view.resolution, self.position(win.get_size()))
 
     @property
     def zoomed_size(self):
-        return int(self.width * self.scale),int(self.height * self.scale)
+        scale = self.view.scale if not self.view is None else 1.0
+        return int(self.width * scale),int(self.height * scale)
 
     def position(self, winsize):
+        view = self.view
         ww, wh = winsize
         iw, ih = self.zoomed_size
         (iw, ih) = (iw, ih) if self.angle in (0, 180) else (ih, iw)
-        ny = (wh - ih) / 2 + self.y
         if iw < ww:
             nx = (ww - iw) / 2
         else:
-            nx = (ww - iw) / 2 + self.x
+            nx = (ww - iw) / 2 + view.x
             if nx > 0: 
-                self.x -= nx
+                view.x -= nx
                 nx = 0
             if nx + iw < ww: 
-                self.x += ww - (nx + iw)
+                view.x += ww - (nx + iw)
                 nx = ww - iw
         if ih < wh:
             ny = (wh - ih) / 2
         else:
-            ny = (wh - ih) / 2 + self.y
+            ny = (wh - ih) / 2 + view.y
             if ny > 0: 
-                self.y -= ny
+                view.y -= ny
                 ny = 0
             if ny + ih < wh: 
-                self.y += wh - (ny + ih)
+                view.y += wh - (ny + ih)
                 ny = wh - ih
         return nx, ny
 
     def move(self, delta):
+        if self.view is None:
+            return
         dx, dy = delta
-        self.x -= dx
-        self.y -= dy
+        self.view.x -= dx
+        self.view.y -= dy
 
     def rotate(self, delta):
         self.angle += delta
@@ -219,89 +488,79 @@ class Entry:
             self.angle = 0
         self.zoom(1)
 
-    def angle(self, angle):
-        self.angle = angle
+    def set_angle(self, angle):
+        self.angle = angle % 360
         self.zoom(1)
 
     def scan(self, basepath):
-        pass
+        '''Read dimensions, orientation, capture time and camera from the file headers.'''
+        if self.entry_type != IMAGE:
+            return
+        try:
+            metadata = read_metadata(os.path.join(basepath, self.filename))
+        except OSError:
+            metadata = None
+        self.apply_metadata(metadata)
+
+    def apply_metadata(self, metadata):
+        '''Store headers read by read_metadata, None if they could not be read.'''
+        if not metadata is None:
+            if metadata['width'] and metadata['height']:
+                self.width, self.height = metadata['width'], metadata['height']
+            self.taken = metadata['taken']
+            self.camera = metadata['camera']
+        self.orientation = metadata['orientation'] if not metadata is None else 1
+        self.scanned = True
+
+    def rename(self, filename, basepath):
+        '''Follow a file that was moved on disk, taking the thumbnail along.'''
+        for_root(basepath).rename(self.filename, filename)
+        self.filename = filename
+
+    def invalidate(self, basepath):
+        '''Forget everything derived from the file contents after it changed on disk.'''
+        for_root(basepath).remove(self.filename)
+        self.width, self.height = 0, 0
+        self.phash = None
+        self.orientation = None
+        self.taken = None
+        self.camera = None
+        self.thumbnail = None
+        self.scanned = False
+        self.unload()
         
     def unload(self):
-        del self.original
-        self.original = None
-        self.zoomed = None
-        self.loaded = False
+        self.view = None
+        imagecache.shared().discard(self)
+
+    def unload_thumbnail(self):
+        self.thumbnail = None
 
     def toggle_category(self, category, directory=None):
         category = category.upper()
+        bit = category_mask(category)
         print("Toggling category '%s'" % category)
-        self.categories = ''.join(self.categories)
-        print("Original categoriesi '%s'" % self.categories)
-        p = self.categories.find(category)
-        if p != -1:
+        print("Original categories '%s'" % self.categories)
+        if self.category_mask & bit:
             print("Removing category '%s'" % category)
-            self.categories = self.categories[:p] + self.categories[p+1:] 
+            self.category_mask &= ~bit
         else:
             print("Adding category '%s'" % category)
-            self.categories += category
+            self.category_mask |= bit
             if not directory is None:
                 catdesc = directory.settings.get('categories', {}).get(category, {})
-                rplc = catdesc.get('replace', '')
-                for r in rplc:
-                    if r in self.categories:
-                        self.toggle_category(r)
-        self.categories = ''.join(sorted(self.categories))
+                self.category_mask &= ~category_mask(catdesc.get('replace', ''))
+        if not directory is None:
+            directory.index(self)
         print("Resulting categories '%s'" % self.categories)
 
     def toggle_marked(self):
         self.marked = not self.marked
 
-    def _resize(self, img, box, fit, out):
-        '''Downsample the image.
-        @param img: Image -  an Image-object
-        @param box: tuple(x, y) - the bounding box of the result image
-        @param fit: boolean - crop the image to fill the box
-        @param out: file-like-object - save the image into the output stream
-        '''
-        #preresize image with factor 2, 4, 8 and fast algorithm
-        factor = 1
-        bw, bh = box
-        iw = self.width
-        ih = self.height
-        while (iw*2/factor > 2*bw) and (ih*2/factor > 2*bh):
-            factor *=2
-        factor /= 2
-        if factor > 1:
-            img.thumbnail((iw/factor, ih/factor), Image.NEAREST)
-
-        #calculate the cropping box and get the cropped part
-        if fit:
-            x1 = y1 = 0
-            x2, y2 = img.size
-            wRatio = 1.0 * x2/box[0]
-            hRatio = 1.0 * y2/box[1]
-            if hRatio > wRatio:
-                y1 = int(y2/2-box[1]*wRatio/2)
-                y2 = int(y2/2+box[1]*wRatio/2)
-            else:
-                x1 = int(x2/2-box[0]*hRatio/2)
-                x2 = int(x2/2+box[0]*hRatio/2)
-            img = img.crop((x1,y1,x2,y2))
-
-        #Resize the image with best quality algorithm ANTI-ALIAS
-        img.thumbnail(box, Image.ANTIALIAS)
-        if self.angle:
-            img = img.rotate(self.angle)
-
-        #save it into a file-like object
-        img.save(out, "JPEG", quality=75)
-
     def delete_from_disk(self, basepath):
         print("Deleting image %s" % self.filename)
-        thumb_filename = os.path.join(basepath, self.filename_thumb)
         filename = os.path.join(basepath, self.filename)
-        if os.path.exists(thumb_filename):
-            os.remove(thumb_filename)
+        for_root(basepath).remove(self.filename)
         if os.path.exists(filename):
             os.remove(filename)
         print("Deleted image %s" % self.filename)
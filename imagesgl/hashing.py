@@ -0,0 +1,34 @@
+#!/usr/bin/env python3
+
+import hashlib
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+CHUNK_SIZE = 1 << 20
+
+def hash_file(filename):
+    '''Stream a file through BLAKE2b.
+    @return: tuple(size, mtime, digest) - size and mtime as stat'ed before reading
+    '''
+    s = os.stat(filename)
+    h = hashlib.blake2b(digest_size=16)
+    with open(filename, 'rb') as f:
+        for chunk in iter(lambda: f.read(CHUNK_SIZE), b''):
+            h.update(chunk)
+    return s.st_size, s.st_mtime_ns, h.hexdigest()
+
+def hash_files(basepath, keys, jobs=1):
+    '''Hash files on a pool of jobs threads.
+
+    hashlib releases the GIL while hashing large buffers, so threads keep
+    several disks and cores busy without the cost of processes.
+    @return: generator of tuple(key, (size, mtime, digest) or None if unreadable)
+    '''
+    def work(key):
+        try:
+            return key, hash_file(os.path.join(basepath, key))
+        except OSError:
+            return key, None
+    with ThreadPoolExecutor(max_workers=max(1, int(jobs))) as pool:
+        for key, digest in pool.map(work, keys):
+            yield key, digest
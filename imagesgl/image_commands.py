@@ -3,6 +3,7 @@
 from imagesgl.command import Param, Command, NeedsInterpreter, NeedsBrowser, NeedsDirectory, NeedsEntry, Shortcut, ShortcutSet
 from imagesgl.command import MOD_CTRL, MOD_SHIFT, MOD_NONE, LETTER
 from imagesgl.browser import MODE_NORMAL, MODE_THUMBS, MODE_INPUT
+from imagesgl.entry import thumb_size_of
 from pygame.locals import *
 
 import os
@@ -40,12 +41,12 @@ class image_shortcuts(ShortcutSet):
 @Param('angle', int, 0)
 class angle(Command):
     def execute(self, entry, directory, browser, angle):
-        entry.angle()
+        entry.set_angle(angle)
+        directory.changed(entry)
         entry.create_thumbnail(
             basepath=directory.basepath,
             block_size = browser.block_size,
-            border = browser.border,
-            override = True
+            border = browser.border
         )
     
     def list_angle(self, interpreter, flt):
@@ -58,11 +59,11 @@ class angle(Command):
 class rotate(Command):
     def execute(self, entry, directory, browser, angle):
         entry.rotate(angle)
+        directory.changed(entry)
         entry.create_thumbnail(
             basepath=directory.basepath,
             block_size = browser.block_size,
-            border = browser.border,
-            override = True
+            border = browser.border
         )
     
     def list_angle(self, interpreter, flt):
@@ -75,6 +76,7 @@ class rotate(Command):
 class rotate_no_thumb(Command):
     def execute(self, entry, directory, browser, angle):
         entry.rotate(angle)
+        directory.changed(entry)
     
     def list_angle(self, interpreter, flt):
         return ['+90', '-90', '+180', '-180']
@@ -86,21 +88,30 @@ class image_move(Command):
         entry.move((x, y))
 
 @NeedsEntry()
+@NeedsDirectory()
 @Param('factor', float, 0.0)
 class zoom(Command):
-    def execute(self, entry, factor):
+    def execute(self, entry, directory, factor):
         entry.zoom(factor)
+        if entry.needs_full:
+            entry.load_image_threaded(directory.basepath)
 
 @NeedsEntry()
+@NeedsDirectory()
 @Param('scale', float, 1.0)
 class zoomset(Command):
-    def execute(self, entry, scale):
+    def execute(self, entry, directory, scale):
         entry.zoom_to(scale)
+        if entry.needs_full:
+            entry.load_image_threaded(directory.basepath)
 
 @NeedsEntry()
+@NeedsDirectory()
 class zoomreset(Command):
-    def execute(self, entry):
+    def execute(self, entry, directory):
         entry.zoom_0()
+        if entry.needs_full:
+            entry.load_image_threaded(directory.basepath)
 
 @NeedsEntry()
 class zoomfit(Command):
@@ -124,13 +135,15 @@ class create_thumbnail(Command):
         return [1, 0]
 
 @NeedsInterpreter()
+@NeedsDirectory()
 @NeedsEntry()
 @Param('width', int, 1)
 @Param('height', int, 1)
 class resize_thumbnail(Command):
-    def execute(self, interpreter, entry, width, height):
-        entry.thumb_size = (width, height)
-        interpreter.run('create_thumbnail', True)
+    def execute(self, interpreter, directory, entry, width, height):
+        entry.thumb_size = thumb_size_of((width, height))
+        directory.changed(entry)
+        interpreter.run('create_thumbnail', False)
 
     def list_width(self, interpreter, flt):
         return [1, 2, 3, 4]
@@ -144,6 +157,7 @@ class resize_thumbnail(Command):
 class toggle_category(Command):
     def execute(self, directory, entry, category):
         entry.toggle_category(category, directory)
+        directory.changed(entry)
 
     def list_category(self, interpreter, flt):
         return [chr(x) for x in range(65, 91)]
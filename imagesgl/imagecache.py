@@ -0,0 +1,85 @@
+#!/usr/bin/env python3
+
+import threading
+from collections import OrderedDict
+
+def view_bytes(view):
+    '''The memory taken by the decoded surfaces of a View.'''
+    size = view.original.get_pitch() * view.original.get_height()
+    return size + sum([tiled.bytes for tiled in view.turns.values()])
+
+class ImageCache:
+    '''The entries with a loaded image, least recently used first.
+
+    When the decoded surfaces take more than max_bytes, the least recently
+    used images are unloaded. The entries of the prefetch window are pinned
+    and never unloaded, even when the window alone is over the budget.
+    '''
+    def __init__(self, max_bytes=512 << 20):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self._entries = OrderedDict()
+        self._pinned = set()
+        self._lock = threading.Lock()
+
+    def __repr__(self):
+        return "<ImageCache %i images %i/%i>" % (len(self._entries), self.size, self.max_bytes)
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, entry):
+        return entry in self._entries
+
+    def pin(self, entries):
+        '''Keep these entries, and only these, from being unloaded.'''
+        with self._lock:
+            self._pinned = set(entries)
+
+    def add(self, entry):
+        '''Count a freshly loaded image, unloading others if it does not fit.'''
+        if entry.view is None:
+            return
+        with self._lock:
+            self.size -= self._entries.pop(entry, 0)
+            self._entries[entry] = view_bytes(entry.view)
+            self.size += self._entries[entry]
+            victims = self._evict()
+        for victim in victims:
+            victim.unload()
+
+    def touch(self, entry):
+        '''Mark the image as used now, and count it again as it may have been zoomed or rotated.'''
+        with self._lock:
+            if not entry in self._entries or entry.view is None:
+                return
+            self.size -= self._entries.pop(entry)
+            self._entries[entry] = view_bytes(entry.view)
+            self.size += self._entries[entry]
+            victims = self._evict()
+        for victim in victims:
+            victim.unload()
+
+    def discard(self, entry):
+        with self._lock:
+            self.size -= self._entries.pop(entry, 0)
+
+    def _evict(self):
+        victims = []
+        for entry in list(self._entries.keys()):
+            if self.size <= self.max_bytes:
+                break
+            if entry in self._pinned:
+                continue
+            self.size -= self._entries.pop(entry)
+            victims.append(entry)
+        return victims
+
+_cache = ImageCache()
+
+def configure(max_mb=512):
+    _cache.max_bytes = int(max_mb) << 20
+
+def shared():
+    '''The ImageCache of all browsers.'''
+    return _cache
@@ -0,0 +1,172 @@
+#!/usr/bin/env python3
+
+import json
+import os
+import threading
+
+def read_snapshot(filename):
+    '''Read a snapshot without decoding the entries.
+
+    Snapshots are written with one entry per line, so every line is only
+    split into its key and the JSON text of the entry, which is decoded
+    when the entry is first used. Older indented snapshots are decoded in
+    full.
+    @return: dict - key -> JSON text (or dict for old snapshots)
+    '''
+    with open(filename, 'r') as f:
+        data = f.read()
+    if not data.startswith('{\n"'):
+        return json.loads(data) if data.strip() else {}
+    entries = {}
+    # The text of an entry has no newlines, so ',\n' only ends entries
+    for line in data[2:data.rindex('\n}')].split(',\n'):
+        key, sep, text = line.partition('": ')
+        if '\\' in key:
+            key, text = next(iter(json.loads('{' + line + '}').items()))
+        else:
+            key = key[1:]
+        entries[key] = text
+    return entries
+
+def write_snapshot(filename, entries):
+    '''Write a snapshot with one entry per line, in key order.
+
+    The keys are read back in that order, so sorting them for the first
+    view costs next to nothing.
+    @param entries: dict - key -> dict, or JSON text as returned by read_snapshot
+    '''
+    tmp = filename + '.tmp'
+    with open(tmp, 'w') as f:
+        f.write('{\n')
+        f.write(',\n'.join([json.dumps(k) + ': ' + (v if isinstance(v, str) else json.dumps(v))
+                            for k, v in sorted(entries.items())]))
+        f.write('\n}\n')
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, filename)
+
+class Journal:
+    '''Append-only log of changes on top of a JSON snapshot.
+
+    Every change is one line holding the key and the complete new state of
+    the entry (or null when it was removed), so replaying a line twice is
+    harmless. When the journal grows past compact_lines it is moved aside
+    and merged into the snapshot on a background thread, while new changes
+    go to a fresh journal.
+    '''
+    def __init__(self, snapshot_file, compact_lines=10000):
+        self.snapshot_file = snapshot_file
+        self.filename = snapshot_file + '.journal'
+        self.compacting_file = self.filename + '.old'
+        self.compact_lines = compact_lines
+        self.lines = 0
+        self.f = None
+        self._thread = None
+
+    def __repr__(self):
+        return "<Journal %s>" % self.filename
+
+    def open(self):
+        if self.f is None:
+            self.f = open(self.filename, 'a')
+            # Keep a torn last line from a crash from swallowing the next one
+            if self.f.tell() > 0:
+                with open(self.filename, 'rb') as f:
+                    f.seek(-1, os.SEEK_END)
+                    if f.read(1) != b'\n':
+                        self.f.write('\n')
+        return self.f
+
+    def close(self):
+        if not self.f is None:
+            self.f.close()
+            self.f = None
+
+    def append(self, key, data):
+        f = self.open()
+        f.write(json.dumps([key, data]) + '\n')
+        f.flush()
+        self.lines += 1
+        if self.lines >= self.compact_lines:
+            self.compact()
+
+    def sync(self):
+        if not self.f is None:
+            os.fsync(self.f.fileno())
+
+    @staticmethod
+    def replay(filename, entries):
+        '''Apply the lines of a journal file onto a dict of entry dicts.
+        A torn last line from a crash is ignored.
+        @return: int - the number of lines applied
+        '''
+        if not os.path.exists(filename):
+            return 0
+        n = 0
+        with open(filename, 'r') as f:
+            for line in f:
+                try:
+                    key, data = json.loads(line)
+                except ValueError:
+                    print("Ignoring broken journal line in %s" % filename)
+                    continue
+                if data is None:
+                    entries.pop(key, None)
+                else:
+                    entries[key] = data
+                n += 1
+        return n
+
+    def load(self):
+        '''Read the snapshot and everything journalled after it.
+        @return: dict - key -> JSON text or dict, see read_snapshot
+        '''
+        entries = {}
+        if os.path.exists(self.snapshot_file):
+            entries = read_snapshot(self.snapshot_file)
+        n = Journal.replay(self.compacting_file, entries)
+        self.lines = Journal.replay(self.filename, entries)
+        if n or self.lines:
+            print("Replayed %i journalled changes" % (n + self.lines))
+        return entries
+
+    def compact(self):
+        '''Merge the journal into the snapshot on a background thread.'''
+        if self.busy:
+            return
+        # A journal left aside by an interrupted compaction is merged first
+        if not os.path.exists(self.compacting_file):
+            self.close()
+            os.rename(self.filename, self.compacting_file)
+            self.lines = 0
+        self._thread = threading.Thread(target=self._compact)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def _compact(self):
+        entries = {}
+        if os.path.exists(self.snapshot_file):
+            entries = read_snapshot(self.snapshot_file)
+        n = Journal.replay(self.compacting_file, entries)
+        write_snapshot(self.snapshot_file, entries)
+        os.remove(self.compacting_file)
+        print("Compacted %i journalled changes into %s" % (n, self.snapshot_file))
+
+    @property
+    def busy(self):
+        return not self._thread is None and self._thread.is_alive()
+
+    def wait(self):
+        if not self._thread is None:
+            self._thread.join()
+            self._thread = None
+
+    def checkpoint(self, entries):
+        '''Write a complete snapshot from memory and start over with an empty journal.'''
+        self.wait()
+        write_snapshot(self.snapshot_file, entries)
+        self.close()
+        for filename in (self.filename, self.compacting_file):
+            if os.path.exists(filename):
+                os.remove(filename)
+        self.lines = 0
@@ -0,0 +1,148 @@
+#!/usr/bin/env python3
+
+import threading
+
+# Threads loading images and thumbnails for display
+LOADER_THREADS = 4
+
+class Request:
+    __slots__ = ('key', 'function', 'group', 'generation', 'started', 'result')
+
+    def __init__(self, key, function, group, generation):
+        self.key = key
+        self.function = function
+        self.group = group
+        self.generation = generation
+        self.started = False
+        self.result = None
+
+    def __repr__(self):
+        return "<Request %r %s %i>" % (self.key, self.group, self.generation)
+
+class Loader:
+    '''Runs display loads on a fixed pool of threads.
+
+    A request is keyed, and a request for a key that is already queued,
+    loading or waiting to be applied is dropped, so asking every frame for
+    the same thumbnail costs nothing. Requests belong to a group and carry
+    the generation of the group they were last asked for in; advance()
+    starts a new generation, and requests of older ones are dropped. The
+    browser advances when the selection or the view moves, which cancels
+    loads nobody will look at.
+
+    The function of a request runs on a loader thread and must not touch
+    anything the main loop uses. It returns a result: a callable that
+    applies what was loaded, or None. Results are collected and applied
+    by apply() on the main thread, once per frame, and only if their
+    generation is still current. The callback is called once when results
+    are waiting, not once per result.
+    '''
+    def __init__(self, workers=LOADER_THREADS, callback=None):
+        self.workers = workers
+        self.callback = callback
+        self.generations = {}
+        self._queue = []
+        self._pending = {}
+        self._done = []
+        self._cond = threading.Condition()
+        self._threads = []
+        self.loaded = 0
+        self.dropped = 0
+        self.peak_depth = 0
+
+    def __repr__(self):
+        return "<Loader %i workers, %i queued (peak %i), %i loaded, %i dropped>" % (
+            self.workers, self.depth, self.peak_depth, self.loaded, self.dropped)
+
+    @property
+    def depth(self):
+        '''The number of requests queued, loading or waiting to be applied.'''
+        return len(self._pending)
+
+    def advance(self, group):
+        '''Start a new generation of group, dropping its requests.
+        @return: int - the new generation
+        '''
+        with self._cond:
+            self.generations[group] = self.generations.get(group, 0) + 1
+            return self.generations[group]
+
+    def request(self, key, function, group):
+        '''Run function on a loader thread unless key is requested already.
+
+        A request asked for again is moved to the current generation, and
+        runs the newer function if it has not started.
+        @return: boolean - whether the request was queued
+        '''
+        with self._cond:
+            generation = self.generations.get(group, 0)
+            request = self._pending.get(key)
+            if not request is None:
+                request.generation = generation
+                if not request.started:
+                    request.function = function
+                return False
+            request = self._pending[key] = Request(key, function, group, generation)
+            self._queue.append(request)
+            self.peak_depth = max(self.peak_depth, len(self._pending))
+            if len(self._threads) < self.workers:
+                t = threading.Thread(target=self._run)
+                t.daemon = True
+                t.start()
+                self._threads.append(t)
+            self._cond.notify()
+        return True
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._queue:
+                    self._cond.wait()
+                request = self._queue.pop(0)
+                if request.generation != self.generations.get(request.group, 0):
+                    del self._pending[request.key]
+                    self.dropped += 1
+                    continue
+                request.started = True
+            try:
+                result = request.function()
+            except Exception as e:
+                print("Cannot load %r (%s)" % (request.key, e.__class__.__name__))
+                result = None
+            with self._cond:
+                self.loaded += 1
+                if result is None:
+                    del self._pending[request.key]
+                    continue
+                request.result = result
+                # One wakeup until the main loop has applied, not one per result
+                signal = len(self._done) == 0
+                self._done.append(request)
+            if signal and not self.callback is None:
+                self.callback()
+
+    def apply(self):
+        '''Apply the results of finished loads that are still wanted, on the main thread.
+        @return: int - the number of results applied
+        '''
+        with self._cond:
+            done = self._done
+            self._done = []
+            for request in done:
+                del self._pending[request.key]
+            wanted = [request for request in done if request.generation == self.generations.get(request.group, 0)]
+            self.dropped += len(done) - len(wanted)
+        for request in wanted:
+            request.result()
+        return len(wanted)
+
+_loader = None
+_loader_lock = threading.Lock()
+
+def shared():
+    '''The Loader of this process, shared by all browsers.'''
+    global _loader
+    with _loader_lock:
+        if _loader is None:
+            _loader = Loader()
+        return _loader
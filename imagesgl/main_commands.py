@@ -4,6 +4,8 @@ import sys
 from imagesgl.command import Param, Command, NeedsInterpreter, NeedsBrowser, NeedsDirectory, NeedsEntry, NeedsEnv, Shortcut, ShortcutSet
 from imagesgl.command import MOD_CTRL, MOD_SHIFT, MOD_NONE
 from imagesgl.browser import MODE_NORMAL, MODE_THUMBS, MODE_INPUT, MODE_ANY
+from imagesgl.thumbpack import for_root
+from imagesgl import loader
 import pygame
 from pygame.locals import *
 
@@ -20,10 +22,14 @@ def __repr__(): return "<module Main Commands>"
 class image_shortcuts(ShortcutSet):
     pass
 
-@NeedsDirectory()
+@NeedsEnv()
 class quit(Command):
-    def execute(self, directory):
+    def execute(self, env):
+        env.thumbnailer.shutdown()
+        print(loader.shared())
+        directory = env.directory
         directory.save()
+        for_root(directory.basepath).compact()
         directory.save_settings()
         pygame.display.quit()
         sys.exit(0)
@@ -0,0 +1,216 @@
+#!/usr/bin/env python3
+
+import io
+import struct
+
+# JPEG start-of-frame markers, all but DHT (C4), JPG (C8) and DAC (CC)
+SOF_MARKERS = set([0xC0, 0xC1, 0xC2, 0xC3, 0xC5, 0xC6, 0xC7,
+                   0xC9, 0xCA, 0xCB, 0xCD, 0xCE, 0xCF])
+SOS = 0xDA
+APP1 = 0xE1
+APP2 = 0xE2
+
+# EXIF tags
+TAG_MAKE = 0x010F
+TAG_MODEL = 0x0110
+TAG_ORIENTATION = 0x0112
+TAG_EXIF_IFD = 0x8769
+TAG_DATETIME = 0x0132
+TAG_DATETIME_ORIGINAL = 0x9003
+TAG_JPEG_OFFSET = 0x0201
+TAG_JPEG_LENGTH = 0x0202
+TAG_MP_ENTRY = 0xB002
+
+# The IFDs come first in the EXIF segment, the embedded thumbnail after them
+EXIF_READ_LIMIT = 16384
+
+# Bytes per component of the TIFF field types
+_TYPE_SIZES = {1: 1, 2: 1, 3: 2, 4: 4, 5: 8, 7: 1, 9: 4, 10: 8}
+
+def read_metadata(filename):
+    '''Read dimensions and EXIF data from the headers of an image file.
+
+    Only the marker segments in front of the compressed data are read,
+    segments other than EXIF are skipped with seek, so this touches a few
+    KB of the file and never decodes pixels.
+    @return: dict - width, height, orientation, taken, camera; None if the format is unknown
+    '''
+    with open(filename, 'rb') as f:
+        head = f.read(24)
+        if head[:2] == b'\xff\xd8':
+            f.seek(2)
+            return _read_jpeg(f)
+        if head[:8] == b'\x89PNG\r\n\x1a\n' and head[12:16] == b'IHDR' and len(head) == 24:
+            width, height = struct.unpack('>II', head[16:24])
+            return {'width': width, 'height': height, 'orientation': 1, 'taken': None, 'camera': None}
+    return None
+
+def read_previews(filename):
+    '''Find the JPEG images embedded in the headers of a JPEG file.
+
+    Cameras store a small thumbnail in the EXIF data, and many a larger
+    preview after the main image that is listed in the MPF segment.
+    @return: list of tuple(offset, length) - where the previews are in the file
+    '''
+    previews = []
+    with open(filename, 'rb') as f:
+        if f.read(2) != b'\xff\xd8':
+            return previews
+        for code, start, length in _segments(f):
+            if code == APP1 and f.read(min(length, 6)) == b'Exif\0\0':
+                tiff = f.read(min(length - 6, EXIF_READ_LIMIT))
+                try:
+                    previews.extend([(start + 6 + offset, n) for offset, n in _exif_thumbnail(tiff)])
+                except (struct.error, IndexError, ValueError):
+                    pass
+            elif code == APP2 and f.read(min(length, 4)) == b'MPF\0':
+                try:
+                    previews.extend([(start + 4 + offset, n) for offset, n in _mpf_images(f.read(length - 4))])
+                except (struct.error, IndexError, ValueError):
+                    pass
+    return previews
+
+def read_preview(filename, width, height):
+    '''Read the smallest embedded preview that covers width x height.
+
+    Previews with another aspect ratio than the image are skipped, some
+    cameras pad the EXIF thumbnail to 4:3 with black bars.
+    @return: bytes - JPEG data, or None if no preview is large enough
+    '''
+    metadata = read_metadata(filename)
+    if metadata is None or not metadata['width'] or not metadata['height']:
+        return None
+    aspect = float(metadata['width']) / metadata['height']
+    found = None
+    with open(filename, 'rb') as f:
+        for offset, length in read_previews(filename):
+            f.seek(offset)
+            data = f.read(length)
+            if data[:2] != b'\xff\xd8':
+                continue
+            size = _read_jpeg(io.BytesIO(data[2:]))
+            w, h = size['width'], size['height']
+            if w < width or h < height or abs(float(w) / h - aspect) > 0.01 * aspect:
+                continue
+            if found is None or w * h < found[0]:
+                found = (w * h, data)
+    return found[1] if not found is None else None
+
+def _segments(f):
+    '''Walk the marker segments in front of the compressed data, f must be past SOI.
+    @return: generator of tuple(code, start, length) - f is at start of the segment data when yielded
+    '''
+    while True:
+        marker = f.read(2)
+        if len(marker) < 2 or marker[0] != 0xFF:
+            return
+        code = marker[1]
+        if code == 0xFF:
+            # Fill byte, the marker code follows
+            f.seek(-1, 1)
+            continue
+        if code == 0x01 or 0xD0 <= code <= 0xD7:
+            # Markers without a length
+            continue
+        length = f.read(2)
+        if len(length) < 2:
+            return
+        length = struct.unpack('>H', length)[0] - 2
+        start = f.tell()
+        yield code, start, length
+        if code in SOF_MARKERS or code == SOS:
+            return
+        f.seek(start + length)
+
+def _read_jpeg(f):
+    result = {'width': 0, 'height': 0, 'orientation': 1, 'taken': None, 'camera': None}
+    for code, start, length in _segments(f):
+        if code in SOF_MARKERS:
+            data = f.read(5)
+            if len(data) == 5:
+                result['height'], result['width'] = struct.unpack('>HH', data[1:5])
+        elif code == APP1:
+            # Only EXIF is read, XMP and others share the marker
+            if f.read(min(length, 6)) == b'Exif\0\0':
+                data = f.read(min(length - 6, EXIF_READ_LIMIT))
+                try:
+                    _read_exif(data, result)
+                except (struct.error, IndexError, ValueError):
+                    pass
+    return result
+
+def _tiff_endian(tiff):
+    if tiff[:2] == b'II':
+        return '<'
+    elif tiff[:2] == b'MM':
+        return '>'
+    return None
+
+def _exif_thumbnail(tiff):
+    '''@return: list of tuple(offset, length) - the thumbnail of IFD1, relative to the TIFF header'''
+    endian = _tiff_endian(tiff)
+    if endian is None:
+        return []
+    ifd0 = struct.unpack(endian + 'I', tiff[4:8])[0]
+    count = struct.unpack(endian + 'H', tiff[ifd0:ifd0+2])[0]
+    ifd1 = struct.unpack(endian + 'I', tiff[ifd0+2+count*12:ifd0+6+count*12])[0]
+    if ifd1 == 0:
+        return []
+    tags = _read_ifd(tiff, endian, ifd1)
+    if not TAG_JPEG_OFFSET in tags or not tags.get(TAG_JPEG_LENGTH):
+        return []
+    return [(tags[TAG_JPEG_OFFSET], tags[TAG_JPEG_LENGTH])]
+
+def _mpf_images(tiff):
+    '''@return: list of tuple(offset, length) - all but the first MP image, relative to the TIFF header'''
+    endian = _tiff_endian(tiff)
+    if endian is None:
+        return []
+    tags = _read_ifd(tiff, endian, struct.unpack(endian + 'I', tiff[4:8])[0])
+    entries = tags.get(TAG_MP_ENTRY, b'')
+    images = []
+    for p in range(16, len(entries) - 15, 16):
+        attributes, size, offset = struct.unpack(endian + 'III', entries[p:p+12])
+        if offset:
+            images.append((offset, size))
+    return images
+
+def _read_exif(tiff, result):
+    endian = _tiff_endian(tiff)
+    if endian is None:
+        return
+    tags = _read_ifd(tiff, endian, struct.unpack(endian + 'I', tiff[4:8])[0])
+    if TAG_EXIF_IFD in tags:
+        tags.update(_read_ifd(tiff, endian, tags[TAG_EXIF_IFD]))
+    orientation = tags.get(TAG_ORIENTATION)
+    if orientation in range(1, 9):
+        result['orientation'] = orientation
+    taken = tags.get(TAG_DATETIME_ORIGINAL) or tags.get(TAG_DATETIME)
+    if taken and taken[:4] != '0000':
+        result['taken'] = taken
+    make, model = tags.get(TAG_MAKE) or '', tags.get(TAG_MODEL) or ''
+    camera = model if model.startswith(make) else (make + ' ' + model).strip()
+    if camera:
+        result['camera'] = camera
+
+def _read_ifd(tiff, endian, offset):
+    '''Read the short, long, ASCII and undefined values of one IFD.'''
+    tags = {}
+    count = struct.unpack(endian + 'H', tiff[offset:offset+2])[0]
+    for i in range(count):
+        p = offset + 2 + i * 12
+        tag, kind, n = struct.unpack(endian + 'HHI', tiff[p:p+8])
+        size = _TYPE_SIZES.get(kind, 1) * n
+        value = tiff[p+8:p+12] if size <= 4 else None
+        if value is None:
+            start = struct.unpack(endian + 'I', tiff[p+8:p+12])[0]
+            value = tiff[start:start+size]
+        if kind == 2:
+            tags[tag] = value[:n].split(b'\0', 1)[0].decode('latin-1').strip()
+        elif kind == 3:
+            tags[tag] = struct.unpack(endian + 'H', value[:2])[0]
+        elif kind == 4:
+            tags[tag] = struct.unpack(endian + 'I', value[:4])[0]
+        elif kind == 7:
+            tags[tag] = value[:n]
+    return tags
@@ -1,16 +1,145 @@
 #!/usr/bin/env python3
 
 import os
+from concurrent.futures import ThreadPoolExecutor
+
+class ScanResult:
+    def __init__(self):
+        self.added = []
+        self.changed = []
+        self.removed = []
+        self.moved = []
+        self.stats = {}
+
+    def __repr__(self):
+        return "<ScanResult +%i ~%i -%i >%i>" % (
+            len(self.added), len(self.changed), len(self.removed), len(self.moved))
+
+    def __len__(self):
+        return len(self.added) + len(self.changed) + len(self.removed) + len(self.moved)
 
 class Scanner:
-    def __init__(self, basepath, ext=[]):
+    def __init__(self, basepath, ext=[], jobs=1):
         self.basepath = basepath
         self.ext = ext
+        self.jobs = max(1, int(jobs))
+
+    def accepts(self, name):
+        return not self.ext or name.split('.')[-1].lower() in self.ext
 
     def scan(self):
-        print("Scanning %s..." % self.basepath)
-        for r, ds, fs in os.walk(self.basepath):
-            for f in fs:
-                if not self.ext or f.split('.')[-1].lower() in self.ext:
-                    yield os.path.relpath(os.path.join(r, f), self.basepath)
-        
+        print("Scanning %s with %i jobs..." % (self.basepath, self.jobs))
+        for folder, mtime, subfolders, files in self.walk():
+            for relpath in sorted(files):
+                yield relpath
+
+    def scan_folder(self, folder):
+        '''List one folder without descending into it.
+        @param folder: str - folder relative to basepath ('' for the root)
+        @return: tuple(mtime, subfolders, files) - files maps relpath to (size, mtime, inode)
+        '''
+        path = os.path.join(self.basepath, folder)
+        mtime = os.stat(path).st_mtime_ns
+        subfolders = []
+        files = {}
+        with os.scandir(path) as it:
+            for d in it:
+                relpath = os.path.join(folder, d.name)
+                try:
+                    if d.is_dir():
+                        # Like os.walk, do not follow symlinked folders
+                        if not d.is_symlink():
+                            subfolders.append(relpath)
+                    elif self.accepts(d.name):
+                        s = d.stat()
+                        files[relpath] = (s.st_size, s.st_mtime_ns, s.st_ino)
+                except OSError:
+                    continue
+        return mtime, sorted(subfolders), files
+
+    def visit(self, folder, old=None, full=True):
+        '''Stat a folder and list it unless its mtime matches old.
+        @return: tuple(mtime, subfolders, files) - files is None if the folder was not listed
+        '''
+        if not full and old is not None:
+            mtime = os.stat(os.path.join(self.basepath, folder)).st_mtime_ns
+            if old[0] == mtime:
+                return mtime, old[1], None
+        return self.scan_folder(folder)
+
+    def walk(self, folders=None, full=True, top=''):
+        '''Visit the tree breadth first, one level at a time.
+
+        All folders of a level are visited in parallel on a pool of
+        self.jobs threads, which hides the stat latency of network mounts.
+        Results are yielded in the order the folders were submitted, so
+        the output does not depend on thread timing.
+        @param folders: dict - folder -> [mtime, subfolders] from a previous scan
+        @param full: boolean - list every folder, even unchanged ones
+        @param top: str - folder to start from, relative to basepath
+        @return: generator of tuple(folder, mtime, subfolders, files)
+        '''
+        if folders is None:
+            folders = {}
+        level = [top]
+        with ThreadPoolExecutor(max_workers=self.jobs) as pool:
+            while level:
+                futures = [(folder, pool.submit(self.visit, folder, folders.get(folder), full))
+                           for folder in level]
+                level = []
+                for folder, future in futures:
+                    try:
+                        mtime, subfolders, files = future.result()
+                    except OSError:
+                        continue
+                    level.extend(subfolders)
+                    yield folder, mtime, subfolders, files
+
+    def scan_incremental(self, folders, known, full=False):
+        '''Compare the tree to the state of the previous scan.
+
+        Folders whose mtime is unchanged are not listed again, but their
+        known subfolders are still visited since those have mtimes of their
+        own. A file rewritten in place does not touch the mtime of its
+        folder, so use full to pick up such changes.
+        @param folders: dict - folder -> [mtime, subfolders], updated in place
+        @param known: dict - relpath -> (size, mtime, inode) or None for cataloged files
+        @param full: boolean - list every folder, even unchanged ones
+        @return: ScanResult - added, changed and removed relpaths
+        '''
+        print("Scanning %s incrementally with %i jobs..." % (self.basepath, self.jobs))
+        result = ScanResult()
+        by_folder = {}
+        for relpath in known:
+            by_folder.setdefault(os.path.dirname(relpath), []).append(relpath)
+        seen = set()
+        listed = 0
+        for folder, mtime, subfolders, files in self.walk(folders, full):
+            seen.add(folder)
+            if files is None:
+                continue
+            listed += 1
+            folders[folder] = [mtime, subfolders]
+            for relpath, stat in files.items():
+                if not relpath in known:
+                    result.added.append(relpath)
+                    result.stats[relpath] = stat
+                elif known[relpath] is None:
+                    result.stats[relpath] = stat
+                elif tuple(known[relpath]) != stat:
+                    result.changed.append(relpath)
+                    result.stats[relpath] = stat
+            for relpath in by_folder.get(folder, []):
+                if not relpath in files:
+                    result.removed.append(relpath)
+        for folder in list(folders.keys()):
+            if not folder in seen:
+                del folders[folder]
+        for folder, relpaths in by_folder.items():
+            if not folder in seen:
+                result.removed.extend(relpaths)
+        result.added.sort()
+        result.changed.sort()
+        result.removed.sort()
+        print("Listed %i of %i folders, %r" % (listed, len(seen), result))
+        return result
@@ -0,0 +1,84 @@
+#!/usr/bin/env python3
+
+import numpy
+from PIL import Image
+
+HASH_SIZE = 8
+
+def dhash(grays):
+    '''Difference hash of a batch of grayscale images.
+
+    Every image is a (HASH_SIZE, HASH_SIZE + 1) array as returned by
+    load_gray, each bit tells whether a pixel is brighter than its right
+    neighbour. The whole batch is compared and packed at once.
+    @param grays: list of numpy arrays
+    @return: list of int - one 64 bit hash per image
+    '''
+    grays = numpy.stack(grays)
+    bits = grays[:, :, 1:] > grays[:, :, :-1]
+    packed = numpy.packbits(bits.reshape(len(grays), -1), axis=1)
+    return [int.from_bytes(row.tobytes(), 'big') for row in packed]
+
+def load_gray(f):
+    '''Read an image shrunk to the size dhash works on.
+    @param f: str or file-like-object
+    '''
+    with Image.open(f) as img:
+        img.draft('L', (HASH_SIZE * 4, HASH_SIZE * 4))
+        small = img.convert('L').resize((HASH_SIZE + 1, HASH_SIZE), Image.BILINEAR)
+        return numpy.asarray(small, dtype=numpy.int16)
+
+def distance(a, b):
+    return bin(a ^ b).count('1')
+
+class BKTree:
+    '''Burkhard-Keller tree over hashes with Hamming distance.
+
+    Every node keeps the children by their distance to it, so a search
+    within radius r only descends into children at distance d - r to
+    d + r, which skips most of the tree for small radii.
+    '''
+    def __init__(self):
+        self.root = None
+        self.size = 0
+
+    def __repr__(self):
+        return "<BKTree %i>" % self.size
+
+    def __len__(self):
+        return self.size
+
+    def add(self, h, key):
+        self.size += 1
+        if self.root is None:
+            self.root = (h, [key], {})
+            return
+        node = self.root
+        while True:
+            d = distance(h, node[0])
+            if d == 0:
+                node[1].append(key)
+                return
+            child = node[2].get(d)
+            if child is None:
+                node[2][d] = (h, [key], {})
+                return
+            node = child
+
+    def search(self, h, radius):
+        '''Find all keys within radius of h.
+        @return: list of tuple(distance, key), nearest first
+        '''
+        found = []
+        if self.root is None:
+            return found
+        stack = [self.root]
+        while stack:
+            node = stack.pop()
+            d = distance(h, node[0])
+            if d <= radius:
+                found.extend([(d, key) for key in node[1]])
+            for cd, child in node[2].items():
+                if d - radius <= cd <= d + radius:
+                    stack.append(child)
+        return sorted(found)
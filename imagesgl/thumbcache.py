@@ -0,0 +1,156 @@
+#!/usr/bin/env python3
+
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+
+CACHE_DIR = os.path.join(os.path.expanduser('~'), '.cache', 'images')
+
+# Bytes read from each end of a file for its content key
+SAMPLE_SIZE = 65536
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS thumbnails (
+    key TEXT PRIMARY KEY,
+    data BLOB,
+    size INTEGER,
+    atime INTEGER
+);
+CREATE INDEX IF NOT EXISTS thumbnails_atime ON thumbnails (atime);
+'''
+
+def content_key(filename):
+    '''Identify a file by its contents without reading all of it.
+
+    The size and the first and last SAMPLE_SIZE bytes are hashed, which
+    tells photos apart in practice and is cheap enough to do per thumbnail.
+    '''
+    h = hashlib.blake2b(digest_size=16)
+    with open(filename, 'rb') as f:
+        size = os.fstat(f.fileno()).st_size
+        h.update(str(size).encode())
+        h.update(f.read(SAMPLE_SIZE))
+        if size > SAMPLE_SIZE:
+            f.seek(max(SAMPLE_SIZE, size - SAMPLE_SIZE))
+            h.update(f.read(SAMPLE_SIZE))
+    return h.hexdigest()
+
+class ThumbCache:
+    '''Thumbnails shared between all roots, keyed by content and block size.
+
+    Kept in an SQLite database with the time of last use of every
+    thumbnail; when the total size passes max_bytes the least recently
+    used are evicted down to 90% of it. Several processes can use the
+    cache at once.
+    '''
+    def __init__(self, path=CACHE_DIR, max_bytes=1 << 30):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.db = None
+        self.size = 0
+        self.misses = set()
+        self._lock = threading.Lock()
+
+    def __repr__(self):
+        return "<ThumbCache %s %i/%i>" % (self.path, self.size, self.max_bytes)
+
+    def connect(self):
+        if self.db is None:
+            os.makedirs(self.path, exist_ok=True)
+            self.db = sqlite3.connect(os.path.join(self.path, 'thumbnails.db'),
+                                      timeout=30, check_same_thread=False)
+            self.db.execute('PRAGMA journal_mode=WAL')
+            self.db.execute('PRAGMA synchronous=NORMAL')
+            self.db.executescript(SCHEMA)
+            self.size = self.db.execute('SELECT COALESCE(SUM(size), 0) FROM thumbnails').fetchone()[0]
+        return self.db
+
+    def close(self):
+        with self._lock:
+            if not self.db is None:
+                self.db.close()
+                self.db = None
+
+    def key(self, filename, block_size, border):
+        return '%s-%i-%i' % (content_key(filename), block_size, border)
+
+    def get(self, key):
+        '''@return: bytes - the thumbnail data, or None if it is not cached'''
+        with self._lock:
+            db = self.connect()
+            row = db.execute('SELECT data FROM thumbnails WHERE key = ?', (key,)).fetchone()
+            if row is None:
+                return None
+            db.execute('UPDATE thumbnails SET atime = ? WHERE key = ?', (int(time.time()), key))
+            db.commit()
+            return row[0]
+
+    def put(self, key, data):
+        with self._lock:
+            db = self.connect()
+            db.execute('INSERT OR REPLACE INTO thumbnails VALUES (?, ?, ?, ?)',
+                       (key, data, len(data), int(time.time())))
+            db.commit()
+            self.size += len(data)
+            if self.size > self.max_bytes:
+                self._evict(db)
+
+    def _evict(self, db):
+        # Other processes add to the cache too, so count again first
+        self.size = db.execute('SELECT COALESCE(SUM(size), 0) FROM thumbnails').fetchone()[0]
+        target = int(self.max_bytes * 0.9)
+        evicted = 0
+        for key, size in db.execute('SELECT key, size FROM thumbnails ORDER BY atime').fetchall():
+            if self.size <= target:
+                break
+            db.execute('DELETE FROM thumbnails WHERE key = ?', (key,))
+            self.size -= size
+            evicted += 1
+        db.commit()
+        print("Evicted %i thumbnails from %s" % (evicted, self.path))
+
+_config = {'path': CACHE_DIR, 'max_bytes': 1 << 30}
+_cache = None
+_cache_lock = threading.Lock()
+# Caches inherited through a fork, kept so their connections are never closed
+_orphans = []
+
+def configure(path=CACHE_DIR, max_mb=1024):
+    '''Set up the shared cache, a size of 0 turns it off.'''
+    global _cache
+    with _cache_lock:
+        _config['path'] = os.path.expanduser(path)
+        _config['max_bytes'] = int(max_mb) << 20
+        _cache = None
+
+def shared():
+    '''The cache of this process, opened again in a forked child.
+    @return: ThumbCache - or None if the cache is turned off
+    '''
+    global _cache
+    if _config['max_bytes'] <= 0:
+        return None
+    with _cache_lock:
+        if _cache is None:
+            _cache = ThumbCache(_config['path'], _config['max_bytes'])
+        return _cache
+
+def _after_fork():
+    '''Start a forked child without the cache of its parent.
+
+    An SQLite connection must not be used across a fork, and closing it in
+    the child, which dropping the last reference does, can roll back or
+    checkpoint the database under the parent. The inherited cache is
+    therefore kept in _orphans and never touched. The lock is replaced in
+    case another thread of the parent held it during the fork.
+    '''
+    global _cache, _cache_lock
+    if not _cache is None:
+        _orphans.append(_cache)
+    _cache = None
+    _cache_lock = threading.Lock()
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_after_fork)
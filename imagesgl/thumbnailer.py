@@ -0,0 +1,277 @@
+#!/usr/bin/env python3
+
+import io
+import math
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from PIL import Image
+from imagesgl import thumbcache
+from imagesgl.metadata import read_metadata, read_preview
+from imagesgl.thumbpack import encode_pyramid, decode_pyramid
+
+def resize(img, box, fit, angle, out):
+    '''Downsample the image.
+    @param img: Image -  an Image-object
+    @param box: tuple(x, y) - the bounding box of the result image
+    @param fit: boolean - crop the image to fill the box
+    @param angle: int - rotate the result by this many degrees
+    @param out: file-like-object - save the image into the output stream
+    '''
+    #let libjpeg decode at 1/2, 1/4 or 1/8 scale, as long as the result still covers the box
+    bw, bh = box
+    iw, ih = img.size
+    scale = max(float(bw)/iw, float(bh)/ih) if fit else min(float(bw)/iw, float(bh)/ih)
+    img.draft(img.mode, (int(math.ceil(iw*scale)), int(math.ceil(ih*scale))))
+
+    #preresize image with factor 2, 4, 8 and fast algorithm
+    factor = 1
+    iw, ih = img.size
+    while (iw*2/factor > 2*bw) and (ih*2/factor > 2*bh):
+        factor *=2
+    factor /= 2
+    if factor > 1:
+        img.thumbnail((iw/factor, ih/factor), Image.NEAREST)
+
+    #calculate the cropping box and get the cropped part
+    if fit:
+        x1 = y1 = 0
+        x2, y2 = img.size
+        wRatio = 1.0 * x2/box[0]
+        hRatio = 1.0 * y2/box[1]
+        if hRatio > wRatio:
+            y1 = int(y2/2-box[1]*wRatio/2)
+            y2 = int(y2/2+box[1]*wRatio/2)
+        else:
+            x1 = int(x2/2-box[0]*hRatio/2)
+            x2 = int(x2/2+box[0]*hRatio/2)
+        img = img.crop((x1,y1,x2,y2))
+
+    #Resize the image with best quality algorithm ANTI-ALIAS
+    img.thumbnail(box, Image.LANCZOS)
+    if angle:
+        img = img.rotate(angle)
+
+    #save it into a file-like object
+    img.save(out, "JPEG", quality=75)
+
+# The tile shapes of the browser, in blocks, closed under rotation
+THUMB_SHAPES = ((1, 1), (2, 2), (3, 2), (2, 3))
+
+# Where thumbnails are made from
+SOURCE_DECODE = 'decode'   # the image itself
+SOURCE_PREVIEW = 'preview' # a preview embedded by the camera if it is large enough, else the image
+
+def thumbnail_box(shape, block_size, border=0):
+    tw, th = shape
+    w = block_size * tw + border * (tw - 1) * 2 
+    h = block_size * th + border * (th - 1) * 2 
+    return w, h
+
+def make_pyramid(infile, block_size, border=0, shapes=THUMB_SHAPES, source=SOURCE_DECODE):
+    '''Decode an image once and make unrotated thumbnails of all shapes from it.
+
+    Safe to run in a worker process. The shared thumbnail cache is
+    consulted first, and filled afterwards unless the thumbnails were
+    made from an embedded preview.
+    @return: bytes - the record made by encode_pyramid
+    '''
+    shapes = sorted(set(shapes))
+    cache = thumbcache.shared()
+    if not cache is None:
+        key = cache.key(infile, block_size, border)
+        data = cache.get(key)
+        if not data is None and all([shape in decode_pyramid(data)[2] for shape in shapes]):
+            return data
+    boxes = [(shape, thumbnail_box(shape, block_size, border)) for shape in shapes]
+    preview = None
+    if source == SOURCE_PREVIEW:
+        preview = _find_preview(infile, [box for shape, box in boxes])
+    images = {}
+    with Image.open(infile if preview is None else io.BytesIO(preview)) as im:
+        # Decode at the scale needed by the largest shape, all others are smaller
+        iw, ih = im.size
+        scale = max([max(float(bw)/iw, float(bh)/ih) for shape, (bw, bh) in boxes])
+        im.draft(im.mode, (int(math.ceil(iw*scale)), int(math.ceil(ih*scale))))
+        im.load()
+        for shape, box in boxes:
+            out = io.BytesIO()
+            resize(im.copy(), box, True, 0, out)
+            images[shape] = out.getvalue()
+    data = encode_pyramid(block_size, border, images, preview=not preview is None)
+    if not cache is None and preview is None:
+        cache.put(key, data)
+    return data
+
+def _find_preview(infile, boxes):
+    '''The smallest embedded preview that covers all boxes when cropped to fill them.'''
+    try:
+        metadata = read_metadata(infile)
+        if metadata is None or not metadata['width'] or not metadata['height']:
+            return None
+        iw, ih = metadata['width'], metadata['height']
+        scale = max([max(float(bw)/iw, float(bh)/ih) for bw, bh in boxes])
+        return read_preview(infile, int(math.ceil(iw*scale)), int(math.ceil(ih*scale)))
+    except OSError:
+        return None
+
+class Job:
+    def __init__(self, key, infile, shapes, block_size, border, pack, source=SOURCE_DECODE):
+        self.key = key
+        self.infile = infile
+        self.shapes = shapes
+        self.block_size = block_size
+        self.border = border
+        self.pack = pack
+        self.source = source
+
+    def __repr__(self):
+        return "<Job %s %s>" % (self.key, self.source)
+
+class Thumbnailer:
+    '''Creates thumbnails on a pool of worker processes.
+
+    Only a few jobs per worker are handed to the pool at a time and the
+    rest wait in a list, so a cancel takes effect right away even with
+    hundreds of thousands of jobs queued. Jobs given to prioritize() are
+    started before the submitted ones; they are replaced by every call,
+    which lets the browser follow the view as it scrolls. The callback
+    is called from a pool thread when jobs have finished; the thumbnails
+    are stored in the ThumbPack of the job right away and the finished
+    keys are fetched with drain() on the main thread.
+    '''
+    def __init__(self, workers=None, callback=None):
+        self.workers = workers or os.cpu_count() or 1
+        self.callback = callback
+        self.pool = None
+        self._lock = threading.Lock()
+        self._queue = []
+        self._wanted = []
+        self._running = 0
+        self._active = set()
+        self._made = set()
+        self._failed = set()
+        self._done = []
+        self.finished = 0
+
+    def __repr__(self):
+        return "<Thumbnailer %i workers>" % self.workers
+
+    @property
+    def busy(self):
+        return self._running > 0 or len(self._queue) > 0 or len(self._wanted) > 0
+
+    @property
+    def progress(self):
+        '''@return: tuple(finished, total) - since the thumbnailer was last idle'''
+        return self.finished, self.finished + self._running + len(self._queue) + len(self._wanted)
+
+    def start(self):
+        '''Fork the worker processes, unless that happened already.
+
+        A forked worker only gets the thread that forked it, so a lock
+        that another thread held at that moment stays locked in the worker
+        for good. Call this before any other thread is started, otherwise
+        the workers are forked on the first submit.
+        '''
+        if self.pool is None:
+            # Fork, the images script cannot be imported again by spawned workers
+            self.pool = ProcessPoolExecutor(max_workers=self.workers,
+                                            mp_context=multiprocessing.get_context('fork'))
+            # All workers are forked for the first job
+            self.pool.submit(int).result()
+
+    def _start(self):
+        self.start()
+        if not self.busy:
+            self.finished = 0
+            self._made = set()
+
+    def submit(self, jobs):
+        with self._lock:
+            self._start()
+            self._queue.extend(reversed(jobs))
+        self._feed()
+
+    def prioritize(self, jobs):
+        '''Start these jobs before all submitted ones, in order.
+
+        The jobs of the previous call that have not been started are
+        dropped, and jobs that are running or have failed are skipped.
+        @param jobs: list of Job - most urgent first
+        '''
+        with self._lock:
+            self._start()
+            self._wanted = [job for job in jobs if not job.key in self._active and not job.key in self._failed]
+        self._feed()
+
+    def _feed(self):
+        with self._lock:
+            batch = []
+            while self._running < self.workers * 2:
+                if self._wanted:
+                    job = self._wanted.pop(0)
+                elif self._queue:
+                    job = self._queue.pop()
+                    if job.key in self._made:
+                        # Made for the view already
+                        self.finished += 1
+                        continue
+                else:
+                    break
+                if job.key in self._active:
+                    continue
+                batch.append(job)
+                self._active.add(job.key)
+                self._running += 1
+        for job in batch:
+            future = self.pool.submit(make_pyramid, job.infile, job.block_size, job.border, job.shapes, job.source)
+            future.add_done_callback(lambda f, job=job: self._finished(job, f))
+
+    def _finished(self, job, future):
+        if future.cancelled():
+            error = "Cancelled thumbnail for '%s'" % job.infile
+        elif not future.exception() is None:
+            error = "Cannot create thumbnail for '%s' (%s)" % (job.infile, future.exception().__class__.__name__)
+        else:
+            error = None
+            job.pack.put(job.key, future.result())
+        with self._lock:
+            self._running -= 1
+            self._active.discard(job.key)
+            if error is None:
+                self._made.add(job.key)
+            else:
+                self._failed.add(job.key)
+            self.finished += 1
+            # One wakeup until the main loop has drained, not one per job
+            signal = len(self._done) == 0
+            self._done.append((job.key, error))
+        self._feed()
+        if signal and not self.callback is None:
+            self.callback()
+
+    def cancel(self):
+        '''Drop the jobs that have not been started, running ones still finish.
+        @return: int - the number of jobs dropped
+        '''
+        with self._lock:
+            n = len(self._queue) + len(self._wanted)
+            self._queue = []
+            self._wanted = []
+        print("Cancelled %i thumbnails" % n)
+        return n
+
+    def drain(self):
+        '''@return: list of tuple(key, error) - jobs finished since the last call'''
+        with self._lock:
+            done = self._done
+            self._done = []
+        return done
+
+    def shutdown(self):
+        self.cancel()
+        if not self.pool is None:
+            self.pool.shutdown()
+            self.pool = None
@@ -0,0 +1,265 @@
+#!/usr/bin/env python3
+
+import json
+import mmap
+import os
+import struct
+import threading
+
+INDEX_FILE = '.thumbnails.index'
+
+_HEADER_LENGTH = struct.Struct('>I')
+
+def encode_pyramid(block_size, border, images, preview=False):
+    '''Put the thumbnails of all shapes of one image into one record.
+
+    The record starts with the length of a JSON header that gives the
+    block size and border, and the offset and length of the JPEG data of
+    every shape after the header.
+    @param images: dict - (width, height) in blocks -> JPEG data
+    @param preview: boolean - the thumbnails were made from an embedded preview
+    '''
+    sizes = []
+    offset = 0
+    for shape in sorted(images.keys()):
+        sizes.append([shape[0], shape[1], offset, len(images[shape])])
+        offset += len(images[shape])
+    header = {'block_size': block_size, 'border': border, 'sizes': sizes}
+    if preview:
+        header['preview'] = True
+    header = json.dumps(header).encode()
+    return _HEADER_LENGTH.pack(len(header)) + header + b''.join([images[shape] for shape in sorted(images.keys())])
+
+def decode_header(data):
+    '''@return: tuple(header, length) - or None for a single JPEG thumbnail from before pyramids'''
+    if data[:2] == b'\xff\xd8':
+        return None
+    n = _HEADER_LENGTH.unpack(data[:4])[0]
+    return json.loads(data[4:4 + n].decode()), 4 + n
+
+def decode_pyramid(data):
+    '''@return: tuple(block_size, border, images) - or None, see decode_header'''
+    decoded = decode_header(data)
+    if decoded is None:
+        return None
+    header, base = decoded
+    images = {(w, h): data[base + o:base + o + l] for w, h, o, l in header['sizes']}
+    return header['block_size'], header['border'], images
+
+class ThumbPack:
+    '''All thumbnails below basepath in one append-only data file.
+
+    The thumbnails of every image (see encode_pyramid) are appended to the pack, and a line
+    [key, offset, length] (or [key, null] for a removal) to the index. The
+    first line of the index names the pack it refers to, so compaction can
+    write a new pack next to the old one and switch over by replacing the
+    index. Reads are slices of a read-only mmap of the pack, which is
+    mapped again when it has grown, so reading a screen of tiles costs no
+    open() or read() calls.
+    '''
+    def __init__(self, basepath):
+        self.basepath = basepath
+        self.index_file = os.path.join(basepath, INDEX_FILE)
+        self.index = {}
+        self.generation = 0
+        self.garbage = 0
+        self.f = None
+        self.index_f = None
+        self.map = None
+        self._lock = threading.Lock()
+
+    def __repr__(self):
+        return "<ThumbPack %s %i>" % (self.pack_file, len(self.index))
+
+    def __len__(self):
+        return len(self.index)
+
+    def __contains__(self, key):
+        return key in self.index
+
+    @property
+    def pack_file(self):
+        return os.path.join(self.basepath, '.thumbnails.%i.pack' % self.generation)
+
+    def exists(self):
+        return os.path.exists(self.index_file)
+
+    def open(self):
+        '''Read the index, or start an empty pack.'''
+        with self._lock:
+            self.index = {}
+            self.garbage = 0
+            if self.exists():
+                with open(self.index_file, 'r') as f:
+                    self.generation = json.loads(f.readline())['generation']
+                    for line in f:
+                        try:
+                            record = json.loads(line)
+                        except ValueError:
+                            print("Ignoring broken line in %s" % self.index_file)
+                            continue
+                        self.index.pop(record[0], None)
+                        if not record[1] is None:
+                            self.index[record[0]] = (record[1], record[2])
+                # Whatever no key points to, a rename moves a record without making garbage
+                if os.path.exists(self.pack_file):
+                    self.garbage = max(0, os.path.getsize(self.pack_file) - sum([l for o, l in self.index.values()]))
+            else:
+                self._write_index()
+            self.f = open(self.pack_file, 'ab')
+            self.index_f = open(self.index_file, 'a')
+            self.map = None
+        print("Opened %i thumbnails in %s" % (len(self.index), self.pack_file))
+
+    def close(self):
+        with self._lock:
+            for f in (self.f, self.index_f):
+                if not f is None:
+                    f.close()
+            self.f = self.index_f = self.map = None
+
+    def _write_index(self, tmp=False):
+        filename = self.index_file + ('.tmp' if tmp else '')
+        with open(filename, 'w') as f:
+            f.write(json.dumps({'generation': self.generation}) + '\n')
+            for key, (offset, length) in self.index.items():
+                f.write(json.dumps([key, offset, length]) + '\n')
+            f.flush()
+            os.fsync(f.fileno())
+        return filename
+
+    def _append(self, record):
+        self.index_f.write(json.dumps(record) + '\n')
+        self.index_f.flush()
+
+    def get(self, key, limit=None):
+        '''@param limit: int - read at most this many bytes
+        @return: bytes - the thumbnail data, or None if there is none
+        '''
+        with self._lock:
+            location = self.index.get(key)
+            if location is None:
+                return None
+            offset, length = location
+            if not limit is None:
+                length = min(length, limit)
+            if self.map is None or offset + length > len(self.map):
+                with open(self.pack_file, 'rb') as f:
+                    self.map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            return self.map[offset:offset + length]
+
+    def location(self, key):
+        '''Where the thumbnails of key are stored, which changes whenever they are replaced.
+        @return: tuple(offset, length) - or None if there are none
+        '''
+        with self._lock:
+            return self.index.get(key)
+
+    def header(self, key):
+        '''The header of the thumbnails of key, without reading the images.
+        @return: dict - or None if there are no thumbnails, or only a single old one
+        '''
+        data = self.get(key, 4)
+        if data is None or len(data) < 4 or data[:2] == b'\xff\xd8':
+            return None
+        data = self.get(key, 4 + _HEADER_LENGTH.unpack(data)[0])
+        return decode_header(data)[0]
+
+    def put(self, key, data):
+        with self._lock:
+            self.f.seek(0, os.SEEK_END)
+            offset = self.f.tell()
+            self.f.write(data)
+            self.f.flush()
+            old = self.index.get(key)
+            if not old is None:
+                self.garbage += old[1]
+            self.index[key] = (offset, len(data))
+            self._append([key, offset, len(data)])
+
+    def remove(self, key):
+        with self._lock:
+            old = self.index.pop(key, None)
+            if old is None:
+                return
+            self.garbage += old[1]
+            self._append([key, None])
+
+    def rename(self, key, new_key):
+        with self._lock:
+            location = self.index.pop(key, None)
+            if location is None:
+                return
+            old = self.index.get(new_key)
+            if not old is None:
+                self.garbage += old[1]
+            self.index[new_key] = location
+            self._append([key, None])
+            self._append([new_key, location[0], location[1]])
+
+    def compact(self, min_garbage=0.5):
+        '''Rewrite the pack without replaced and removed thumbnails, in key order.
+
+        Only done when at least min_garbage of the pack is unused. The new
+        pack is complete on disk before the index is switched over to it.
+        '''
+        with self._lock:
+            size = self.f.seek(0, os.SEEK_END)
+            if size == 0 or self.garbage < size * min_garbage:
+                return False
+            with open(self.pack_file, 'rb') as f:
+                old_map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            old_pack = self.pack_file
+            self.generation += 1
+            index = {}
+            with open(self.pack_file, 'wb') as f:
+                for key in sorted(self.index.keys()):
+                    offset, length = self.index[key]
+                    index[key] = (f.tell(), length)
+                    f.write(old_map[offset:offset + length])
+                f.flush()
+                os.fsync(f.fileno())
+            self.index = index
+            os.replace(self._write_index(tmp=True), self.index_file)
+            self.f.close()
+            self.index_f.close()
+            self.f = open(self.pack_file, 'ab')
+            self.index_f = open(self.index_file, 'a')
+            old_map.close()
+            self.map = None
+            self.garbage = 0
+            os.remove(old_pack)
+        print("Compacted %s from %i to %i bytes" % (self.pack_file, size, sum([l for o, l in index.values()])))
+        return True
+
+    def migrate(self, keys):
+        '''Move the thumbnails of the given keys from <key>.thumbnail files into the pack.
+        @return: int - the number of files moved
+        '''
+        n = 0
+        for key in keys:
+            filename = os.path.join(self.basepath, key + '.thumbnail')
+            try:
+                with open(filename, 'rb') as f:
+                    self.put(key, f.read())
+            except OSError:
+                continue
+            os.remove(filename)
+            n += 1
+            if n % 1000 == 0:
+                print("Moved %i thumbnails into %s" % (n, self.pack_file))
+        print("Moved %i thumbnails into %s" % (n, self.pack_file))
+        return n
+
+_packs = {}
+_packs_lock = threading.Lock()
+
+def for_root(basepath):
+    '''The open ThumbPack of a root folder, shared by all entries below it.'''
+    basepath = os.path.abspath(basepath)
+    with _packs_lock:
+        pack = _packs.get(basepath)
+        if pack is None:
+            pack = _packs[basepath] = ThumbPack(basepath)
+            pack.open()
+        return pack
@@ -0,0 +1,107 @@
+#!/usr/bin/env python3
+
+import math
+import pygame
+from collections import OrderedDict
+
+# Edge of a tile on screen, in pixels
+TILE_SIZE = 256
+
+# Tiles kept after they scrolled out of view, about 32MB at 32 bits per pixel
+MAX_TILES = 128
+
+def turn(surface, angle):
+    '''Rotate a surface counter-clockwise by angle degrees.
+
+    Quarter turns only move pixels and lose nothing, a half turn is a
+    flip of both axes. Other angles are interpolated.
+    '''
+    angle %= 360
+    if angle == 0:
+        return surface
+    if angle == 180:
+        return pygame.transform.flip(surface, True, True)
+    return pygame.transform.rotate(surface, angle)
+
+class TiledImage:
+    '''Draws a surface at any scale by resampling only the tiles in view.
+
+    The surface is kept in levels, each half the size of the one before,
+    made when first needed. A scale is drawn from the smallest level that
+    is at least as large, so no tile is shrunk by more than half and none
+    is made from more pixels than needed, and the scale of a level itself
+    is blitted directly. Tiles are cut in the coordinates
+    of the level, so neighbours round to the same screen edges, and the
+    most recently drawn are kept for panning back and forth.
+    '''
+    def __init__(self, original, angle=0, max_tiles=MAX_TILES):
+        self.angle = angle
+        self.levels = [turn(original, angle)]
+        self.max_tiles = max_tiles
+        self.tiles = OrderedDict()
+
+    def __repr__(self):
+        w, h = self.levels[0].get_size()
+        return "<TiledImage %ix%i %i levels %i tiles>" % (w, h, len(self.levels), len(self.tiles))
+
+    @property
+    def bytes(self):
+        '''The memory taken by levels and tiles other than the original.'''
+        surfaces = self.levels[1:] + list(self.tiles.values())
+        if self.angle:
+            surfaces.append(self.levels[0])
+        return sum([s.get_pitch() * s.get_height() for s in surfaces])
+
+    def size(self, scale):
+        w, h = self.levels[0].get_size()
+        return int(round(w * scale)), int(round(h * scale))
+
+    def _level(self, scale):
+        '''@return: tuple(level, scale) - the level to draw scale from and the scale relative to it'''
+        k = max(0, int(math.floor(math.log(1.0 / scale, 2)))) if scale < 1 else 0
+        while len(self.levels) <= k:
+            w, h = self.levels[-1].get_size()
+            if w < 2 or h < 2:
+                break
+            self.levels.append(pygame.transform.smoothscale(self.levels[-1], (w // 2, h // 2)))
+        k = min(k, len(self.levels) - 1)
+        level = self.levels[k]
+        return k, scale * self.levels[0].get_width() / level.get_width()
+
+    def draw(self, win, scale, pos):
+        '''Draw the surface at scale with its top left corner at pos, only where win shows it.'''
+        k, g = self._level(scale)
+        level = self.levels[k]
+        lw, lh = level.get_size()
+        # The edge of a tile in level pixels, so that it is about TILE_SIZE on screen
+        edge = max(1, int(math.ceil(TILE_SIZE / g)))
+        x0, y0 = int(pos[0]), int(pos[1])
+        ww, wh = win.get_size()
+        if g == 1:
+            # The scale of a level, nothing to resample
+            win.blit(level, (x0, y0))
+            return
+        first_i = max(0, int((-x0) / g) // edge)
+        first_j = max(0, int((-y0) / g) // edge)
+        last_i = min((lw - 1) // edge, int((ww - x0) / g) // edge)
+        last_j = min((lh - 1) // edge, int((wh - y0) / g) // edge)
+        for j in range(first_j, last_j + 1):
+            for i in range(first_i, last_i + 1):
+                sx0, sy0 = i * edge, j * edge
+                sx1, sy1 = min(sx0 + edge, lw), min(sy0 + edge, lh)
+                dx0, dy0 = int(round(sx0 * g)), int(round(sy0 * g))
+                dx1, dy1 = int(round(sx1 * g)), int(round(sy1 * g))
+                if dx1 <= dx0 or dy1 <= dy0:
+                    continue
+                tile = self._tile((k, g, i, j), level, (sx0, sy0, sx1 - sx0, sy1 - sy0), (dx1 - dx0, dy1 - dy0))
+                win.blit(tile, (x0 + dx0, y0 + dy0))
+
+    def _tile(self, key, level, rect, size):
+        tile = self.tiles.pop(key, None)
+        if tile is None:
+            part = level.subsurface(rect)
+            tile = part.copy() if part.get_size() == size else pygame.transform.smoothscale(part, size)
+            while len(self.tiles) >= self.max_tiles:
+                self.tiles.popitem(last=False)
+        self.tiles[key] = tile
+        return tile
@@ -0,0 +1,283 @@
+#!/usr/bin/env python3
+
+import ctypes
+import ctypes.util
+import errno
+import os
+import select
+import struct
+import threading
+import time
+from collections import OrderedDict
+from imagesgl.scanner import ScanResult
+
+# From <sys/inotify.h>
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_ISDIR = 0x40000000
+IN_CLOEXEC = 0o2000000
+
+WATCH_MASK = (IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE |
+              IN_DELETE | IN_DELETE_SELF | IN_ONLYDIR)
+
+_EVENT = struct.Struct('iIII')
+
+class Watcher:
+    '''Follows changes below basepath with inotify.
+
+    Events are collected on a reader thread and coalesced: the callback is
+    called once when the tree has been quiet for delay seconds (or at the
+    latest max_delay seconds after the first event), and not again until the
+    main loop has fetched the changes with drain(). Copying thousands of
+    files thus results in a handful of batches instead of one per file.
+
+    The two halves of a move are paired by their cookie, also when they
+    arrive in different batches. A half that finds no partner within
+    move_timeout seconds, or when more than max_moves are waiting, was a
+    move out of the watched tree and counts as a deletion.
+    '''
+    def __init__(self, scanner, callback=None, delay=0.5, max_delay=2.0, move_timeout=1.0, max_moves=1000):
+        self.scanner = scanner
+        self.basepath = scanner.basepath
+        self.callback = callback
+        self.delay = delay
+        self.max_delay = max_delay
+        self.move_timeout = move_timeout
+        self.max_moves = max_moves
+        self.fd = None
+        self._libc = None
+        self._lock = threading.Lock()
+        self._watches = {}
+        self._moves = OrderedDict()
+        self._reset()
+
+    def __repr__(self):
+        return "<Watcher %s>" % self.basepath
+
+    def _reset(self):
+        self._paths = set()
+        self._renames = []
+        self._new_folders = []
+        self._gone_folders = []
+        self._overflow = False
+        self._first = None
+        self._last = None
+        self._signalled = False
+
+    def start(self, folders):
+        '''Start watching the given folders (relative to basepath).'''
+        self._libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+        self.fd = self._libc.inotify_init1(IN_CLOEXEC)
+        if self.fd < 0:
+            e = ctypes.get_errno()
+            raise OSError(e, os.strerror(e))
+        for folder in sorted(folders):
+            if not self._add_watch(folder):
+                break
+        print("Watching %i folders in %s" % (len(self._watches), self.basepath))
+        t = threading.Thread(target=self._run)
+        t.daemon = True
+        t.start()
+
+    def _add_watch(self, folder):
+        path = os.fsencode(os.path.join(self.basepath, folder))
+        wd = self._libc.inotify_add_watch(self.fd, path, WATCH_MASK)
+        if wd < 0:
+            e = ctypes.get_errno()
+            if e == errno.ENOSPC:
+                print("Cannot watch more folders, raise fs.inotify.max_user_watches")
+                return False
+            return True
+        with self._lock:
+            self._watches[wd] = folder
+        return True
+
+    def _add_tree(self, folder):
+        self._add_watch(folder)
+        for r, ds, fs in os.walk(os.path.join(self.basepath, folder)):
+            for d in ds:
+                self._add_watch(os.path.relpath(os.path.join(r, d), self.basepath))
+
+    def _remove_watches(self, folder):
+        prefix = folder + os.sep
+        with self._lock:
+            wds = [w for w, f in self._watches.items() if f == folder or f.startswith(prefix)]
+            for w in wds:
+                del self._watches[w]
+        for w in wds:
+            self._libc.inotify_rm_watch(self.fd, w)
+
+    def _due(self):
+        '''@return: float - when the collected changes are to be signalled, None if not pending'''
+        if self._first is None or self._signalled:
+            return None
+        return min(self._last + self.delay, self._first + self.max_delay)
+
+    def _run(self):
+        while True:
+            with self._lock:
+                deadlines = [d for d in (self._due(),) if not d is None]
+                if self._moves:
+                    # The oldest move that is waiting for its other half
+                    deadlines.append(next(iter(self._moves.values()))[2] + self.move_timeout)
+                timeout = max(0, min(deadlines) - time.time()) if deadlines else None
+            ready, _, _ = select.select([self.fd], [], [], timeout)
+            if ready:
+                self._read(os.read(self.fd, 65536))
+            else:
+                now = time.time()
+                self._expire(now)
+                with self._lock:
+                    due = self._due()
+                if not due is None and due <= now:
+                    self._signal()
+
+    def _expire(self, now):
+        '''Count the moves whose other half did not come in time as deletions.'''
+        with self._lock:
+            while self._moves:
+                cookie, (relpath, isdir, started) = next(iter(self._moves.items()))
+                if started + self.move_timeout > now and len(self._moves) <= self.max_moves:
+                    break
+                del self._moves[cookie]
+                if isdir:
+                    self._gone_folders.append(relpath)
+                else:
+                    self._paths.add(relpath)
+                if self._first is None:
+                    self._first = now
+                self._last = now
+
+    def _signal(self):
+        with self._lock:
+            if self._first is None or self._signalled:
+                return
+            self._signalled = True
+        if not self.callback is None:
+            self.callback()
+
+    def _read(self, data):
+        now = time.time()
+        i = 0
+        while i < len(data):
+            wd, mask, cookie, length = _EVENT.unpack_from(data, i)
+            name = data[i + _EVENT.size:i + _EVENT.size + length].rstrip(b'\0')
+            i += _EVENT.size + length
+            self._event(wd, mask, cookie, os.fsdecode(name), now)
+        self._expire(now)
+        with self._lock:
+            if self._first is None:
+                self._first = now
+            self._last = now
+
+    def _event(self, wd, mask, cookie, name, now):
+        if mask & IN_Q_OVERFLOW:
+            with self._lock:
+                self._overflow = True
+            return
+        with self._lock:
+            folder = self._watches.get(wd)
+        if folder is None:
+            return
+        if mask & (IN_IGNORED | IN_DELETE_SELF):
+            with self._lock:
+                self._watches.pop(wd, None)
+            return
+        relpath = os.path.join(folder, name)
+        isdir = bool(mask & IN_ISDIR)
+        if isdir and mask & (IN_CREATE | IN_MOVED_TO) and not cookie in self._moves:
+            self._add_tree(relpath)
+        with self._lock:
+            if mask & IN_MOVED_FROM:
+                # Reported once the other half arrives, or as a deletion by _expire
+                self._moves[cookie] = (relpath, isdir, now)
+            elif mask & IN_MOVED_TO and cookie in self._moves:
+                old, isdir, started = self._moves.pop(cookie)
+                self._renames.append((old, relpath, isdir))
+                if isdir:
+                    prefix = old + os.sep
+                    for w, f in self._watches.items():
+                        if f == old or f.startswith(prefix):
+                            self._watches[w] = relpath + f[len(old):]
+            elif isdir:
+                if mask & IN_DELETE:
+                    self._gone_folders.append(relpath)
+                elif mask & (IN_CREATE | IN_MOVED_TO):
+                    self._new_folders.append(relpath)
+            elif self.scanner.accepts(name) and mask & (IN_CLOSE_WRITE | IN_MOVED_TO | IN_DELETE):
+                self._paths.add(relpath)
+
+    def drain(self, directory):
+        '''Turn the events collected since the last call into a ScanResult.
+
+        Paths are checked against the disk and the directory at this point,
+        so a file created and removed within one batch is not reported.
+        Moves still waiting for their other half are kept for the next call.
+        @return: ScanResult - or None if the kernel queue overflowed and a rescan is needed
+        '''
+        self._expire(time.time())
+        with self._lock:
+            paths = self._paths
+            renames = self._renames
+            new_folders = self._new_folders
+            gone_folders = self._gone_folders
+            overflow = self._overflow
+            self._reset()
+        if overflow:
+            print("Watch queue overflowed, rescan needed")
+            return None
+
+        result = ScanResult()
+        for old, new, isdir in renames:
+            if isdir:
+                prefix = old + os.sep
+                result.moved.extend([(k, new + k[len(old):]) for k in directory.keys() if k.startswith(prefix)])
+            elif old in directory and self.scanner.accepts(new):
+                result.moved.append((old, new))
+            else:
+                paths.discard(old)
+                if old in directory:
+                    paths.add(old)
+                paths.add(new)
+        moved = {old: new for old, new in result.moved}
+        for folder in gone_folders:
+            prefix = folder + os.sep
+            self._remove_watches(folder)
+            paths.update([k for k in directory.keys() if k.startswith(prefix) and not k in moved])
+        for folder in new_folders:
+            for f, mtime, subfolders, files in self.scanner.walk(top=folder):
+                paths.update(files.keys())
+
+        for relpath in sorted(paths):
+            if relpath in moved:
+                continue
+            try:
+                s = os.stat(os.path.join(self.basepath, relpath))
+                stat = (s.st_size, s.st_mtime_ns, s.st_ino)
+            except OSError:
+                stat = None
+            known = relpath in directory
+            if stat is None:
+                if known:
+                    result.removed.append(relpath)
+            elif not known:
+                result.added.append(relpath)
+                result.stats[relpath] = stat
+            elif directory.stat_of(relpath) is None or tuple(directory.stat_of(relpath)) != stat:
+                result.changed.append(relpath)
+                result.stats[relpath] = stat
+        for old, new in result.moved:
+            try:
+                s = os.stat(os.path.join(self.basepath, new))
+                result.stats[new] = (s.st_size, s.st_mtime_ns, s.st_ino)
+            except OSError:
+                pass
+        print("Watcher batch %r" % result)
+        return result
@@ -0,0 +1,98 @@
+#!/usr/bin/env python3
+
+import threading
+import time
+import unittest
+from imagesgl import background
+from imagesgl.background import Background
+
+def wait_for(condition, timeout=5.0):
+    end = time.time() + timeout
+    while not condition():
+        if time.time() > end:
+            raise AssertionError("timed out")
+        time.sleep(0.005)
+
+class TestBackground(unittest.TestCase):
+    def setUp(self):
+        self.wakeups = []
+        self.background = Background(callback=lambda: self.wakeups.append(1))
+        self.applied = []
+        # Holds the background thread until released
+        self.gate = threading.Event()
+
+    def tearDown(self):
+        self.gate.set()
+
+    def job(self, value, block=False):
+        def work():
+            if block:
+                self.gate.wait()
+            return lambda: self.applied.append(value)
+        return work
+
+    def test_results_are_applied_in_order_on_apply(self):
+        for value in 'abc':
+            self.background.submit(self.job(value), 'test')
+        wait_for(lambda: len(self.background._done) == 3)
+        self.assertEqual(self.applied, [])
+        self.assertEqual(len(self.wakeups), 1)
+        self.assertEqual(self.background.apply(), 3)
+        self.assertEqual(self.applied, ['a', 'b', 'c'])
+
+    def test_advance_drops_older_jobs(self):
+        self.background.submit(self.job('block', block=True), 'other')
+        self.background.submit(self.job('a'), 'test')
+        self.background.advance('test')
+        self.background.submit(self.job('b'), 'test')
+        self.gate.set()
+        wait_for(lambda: len(self.background._done) == 2)
+        self.background.submit(self.job('c'), 'test')
+        wait_for(lambda: len(self.background._done) == 3)
+        self.background.advance('test')
+        self.assertEqual(self.background.apply(), 1)
+        self.assertEqual(self.applied, ['block'])
+
+    def test_none_and_errors_apply_nothing(self):
+        def fail():
+            raise OSError("unreadable")
+        self.background.submit(lambda: None, 'test')
+        self.background.submit(fail, 'test')
+        self.background.submit(self.job('a'), 'test')
+        wait_for(lambda: len(self.background._done) == 1)
+        self.assertEqual(self.background.apply(), 1)
+        self.assertEqual(self.applied, ['a'])
+
+class TestRunBatches(unittest.TestCase):
+    def run_until(self, done):
+        wait_for(lambda: background.shared().apply() >= 0 and done())
+
+    def test_batches_in_order(self):
+        applied = []
+        background.run_batches(list(range(25)), sum, lambda result, finished: applied.append((result, finished)),
+                               'test_batches', size=10)
+        self.run_until(lambda: len(applied) == 3)
+        self.assertEqual(applied, [(45, 10), (145, 20), (110, 25)])
+
+    def test_no_keys(self):
+        applied = []
+        background.run_batches([], len, lambda result, finished: applied.append((result, finished)), 'test_batches')
+        self.run_until(lambda: len(applied) == 1)
+        self.assertEqual(applied, [(0, 0)])
+
+    def test_new_run_drops_the_last(self):
+        applied = []
+        gate = threading.Event()
+        def work(batch):
+            gate.wait()
+            return batch
+        background.run_batches(['a', 'b'], work, lambda result, finished: applied.append(result), 'test_batches', size=1)
+        background.run_batches(['c'], work, lambda result, finished: applied.append(result), 'test_batches', size=1)
+        gate.set()
+        self.run_until(lambda: ['c'] in applied)
+        time.sleep(0.05)
+        background.shared().apply()
+        self.assertEqual(applied, [['c']])
+
+if __name__ == '__main__':
+    unittest.main()
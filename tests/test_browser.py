@@ -0,0 +1,49 @@
+#!/usr/bin/env python3
+
+import unittest
+
+try:
+    from imagesgl.directory import Directory
+    from imagesgl.entry import Entry
+    from imagesgl.browser import Browser, MODE_THUMBS
+except ImportError:
+    # The browser needs pygame and PIL through the entries
+    Browser = None
+
+@unittest.skipIf(Browser is None, "needs pygame and PIL")
+class TestBrowser(unittest.TestCase):
+    keys = ['a.jpg', 'b.jpg', 'c.jpg', 'd.jpg']
+
+    def setUp(self):
+        self.directory = Directory('.')
+        for key in self.keys[:3]:
+            self.directory[key] = Entry(key)
+        # Not decoded yet
+        self.directory.entries['d.jpg'] = '{"filename": "d.jpg"}'
+
+    def browser(self):
+        browser = Browser(self.directory, MODE_THUMBS)
+        browser.use_keys(self.keys)
+        return browser
+
+    def test_marked_through_another_browser(self):
+        first, second = self.browser(), self.browser()
+        first.entries[1].marked = True
+        first.entries[2].marked = True
+        self.assertEqual(list(second.get_marked_keys()), ['b.jpg', 'c.jpg'])
+        second.mark_none()
+        self.assertEqual(list(first.marked), [])
+        self.assertFalse(isinstance(self.directory.entries['d.jpg'], Entry))
+
+    def test_remove_keys_keeps_the_selection(self):
+        browser = self.browser()
+        browser.goto(2)
+        browser.remove_keys(['a.jpg', 'd.jpg'])
+        self.assertEqual(browser.entries.keys, ['b.jpg', 'c.jpg'])
+        self.assertEqual(browser.selected_index, 1)
+        self.assertEqual(browser.selected_image.filename, 'c.jpg')
+        browser.remove_keys(['c.jpg'])
+        self.assertEqual(browser.selected_image.filename, 'b.jpg')
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,125 @@
+#!/usr/bin/env python3
+
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+try:
+    from imagesgl.directory import Directory, raw_field
+    from imagesgl.catalog import SqliteDirectory
+    from imagesgl.entry import Entry
+except ImportError:
+    # The directory needs pygame and PIL through the entries
+    raw_field = None
+
+@unittest.skipIf(raw_field is None, "needs pygame and PIL")
+class TestRawField(unittest.TestCase):
+    raw = json.dumps({
+        'filename': 'a, b.jpg',
+        'category_mask': 5,
+        'angle': -90,
+        'comment': None,
+        'stat': [12, 1400000000000000000, 7],
+        'thumb_size': [2, 1],
+        'scanned': True,
+    })
+
+    def test_fields(self):
+        self.assertEqual(raw_field(self.raw, 'filename'), 'a, b.jpg')
+        self.assertEqual(raw_field(self.raw, 'category_mask'), 5)
+        self.assertEqual(raw_field(self.raw, 'angle'), -90)
+        self.assertEqual(raw_field(self.raw, 'comment'), None)
+        self.assertEqual(raw_field(self.raw, 'stat'), [12, 1400000000000000000, 7])
+        self.assertEqual(raw_field(self.raw, 'thumb_size'), [2, 1])
+        self.assertEqual(raw_field(self.raw, 'scanned'), True)
+
+    def test_last_field(self):
+        self.assertEqual(raw_field('{"angle": 180}', 'angle'), 180)
+
+    def test_missing_field(self):
+        self.assertEqual(raw_field(self.raw, 'phash'), None)
+
+    def test_decoded_entry(self):
+        self.assertEqual(raw_field(json.loads(self.raw), 'angle'), -90)
+
+@unittest.skipIf(raw_field is None, "needs pygame and PIL")
+class TestLazyCatalog(unittest.TestCase):
+    catalog = 'directory.json'
+
+    def setUp(self):
+        self.basepath = tempfile.mkdtemp()
+        self.directory_file = os.path.join(self.basepath, self.catalog)
+
+    def tearDown(self):
+        shutil.rmtree(self.basepath)
+
+    def make(self):
+        return Directory(self.basepath)
+
+    def close(self, directory):
+        directory.journal.close()
+
+    def saved(self):
+        '''A directory loaded from a catalog with three entries.'''
+        directory = self.make()
+        directory.load(self.directory_file)
+        for filename, categories in (('a.jpg', 'AB'), ('b.jpg', 'B'), ('c.jpg', '')):
+            entry = Entry(filename)
+            entry.categories = categories
+            entry.stat = (1, 2, 3)
+            directory[filename] = entry
+        directory.save()
+        self.close(directory)
+        directory = self.make()
+        directory.load(self.directory_file)
+        return directory
+
+    def test_entries_are_decoded_on_first_use(self):
+        directory = self.saved()
+        self.assertFalse(any([isinstance(v, Entry) for v in directory.entries.values()]))
+        self.assertEqual(sorted(directory.get_filtered_keys(incl='B')), ['a.jpg', 'b.jpg'])
+        self.assertEqual(sorted(directory.get_filtered_keys(incl='B', excl='A')), ['b.jpg'])
+        self.assertEqual(directory.stat_of('c.jpg'), (1, 2, 3))
+        self.assertFalse(isinstance(directory.entries['a.jpg'], Entry))
+        self.assertEqual(directory['a.jpg'].categories, 'AB')
+        self.assertTrue(isinstance(directory.entries['a.jpg'], Entry))
+        self.close(directory)
+
+    def test_index_built_in_the_background(self):
+        directory = self.saved()
+        self.assertFalse(directory.indexed)
+        work = directory.read_index()
+        # Changes made while the index is built are indexed again
+        directory['a.jpg'].categories = 'C'
+        directory.changed(directory['a.jpg'])
+        del directory['b.jpg']
+        entry = Entry('d.jpg')
+        entry.categories = 'B'
+        directory['d.jpg'] = entry
+        self.assertTrue(directory.apply_index(work()))
+        self.assertEqual(sorted(directory.get_filtered_keys(incl='B')), ['d.jpg'])
+        self.assertEqual(sorted(directory.get_filtered_keys(incl='C')), ['a.jpg'])
+        self.assertEqual(directory.category_counts(), {'B': 1, 'C': 1})
+        self.close(directory)
+
+    def test_index_built_when_needed_first(self):
+        directory = self.saved()
+        work = directory.read_index()
+        self.assertEqual(sorted(directory.get_filtered_keys(excl='B')), ['c.jpg'])
+        self.assertTrue(directory.indexed)
+        self.assertFalse(directory.apply_index(work()))
+        self.close(directory)
+
+class TestLazySqliteCatalog(TestLazyCatalog):
+    catalog = 'directory.sqlite'
+
+    def make(self):
+        return SqliteDirectory(self.basepath)
+
+    def close(self, directory):
+        directory.close()
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,130 @@
+#!/usr/bin/env python3
+
+import json
+import os
+import shutil
+import tempfile
+import unittest
+from imagesgl.journal import Journal, read_snapshot, write_snapshot
+
+try:
+    from imagesgl.directory import Directory
+    from imagesgl.entry import Entry
+except ImportError:
+    # The directory needs pygame and PIL through the entries
+    Directory = None
+
+def decoded(entry):
+    return json.loads(entry) if isinstance(entry, str) else entry
+
+class TestJournal(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.snapshot = os.path.join(self.tmp, '.directory.json')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def test_snapshot_keeps_entries_as_text(self):
+        write_snapshot(self.snapshot, {'a.jpg': {'angle': 90}, 'b "c".jpg': '{"angle": 0}'})
+        entries = read_snapshot(self.snapshot)
+        self.assertEqual(sorted(entries.keys()), ['a.jpg', 'b "c".jpg'])
+        self.assertIsInstance(entries['a.jpg'], str)
+        self.assertEqual(decoded(entries['a.jpg']), {'angle': 90})
+        # Escaped keys are decoded with their entry
+        self.assertEqual(decoded(entries['b "c".jpg']), {'angle': 0})
+
+    def test_snapshot_in_key_order(self):
+        write_snapshot(self.snapshot, {'b.jpg': {}, 'c.jpg': {}, 'a.jpg': {}})
+        self.assertEqual(list(read_snapshot(self.snapshot).keys()), ['a.jpg', 'b.jpg', 'c.jpg'])
+        write_snapshot(self.snapshot, {})
+        self.assertEqual(read_snapshot(self.snapshot), {})
+
+    def test_old_indented_snapshot(self):
+        with open(self.snapshot, 'w') as f:
+            json.dump({'a.jpg': {'angle': 90}}, f, indent=4)
+        self.assertEqual(read_snapshot(self.snapshot), {'a.jpg': {'angle': 90}})
+
+    def test_replay_onto_snapshot(self):
+        write_snapshot(self.snapshot, {'a.jpg': {'angle': 0}, 'b.jpg': {'angle': 0}})
+        journal = Journal(self.snapshot)
+        journal.append('a.jpg', {'angle': 90})
+        journal.append('b.jpg', None)
+        journal.append('c.jpg', {'angle': 180})
+        journal.close()
+        entries = Journal(self.snapshot).load()
+        self.assertEqual(sorted(entries.keys()), ['a.jpg', 'c.jpg'])
+        self.assertEqual(entries['a.jpg'], {'angle': 90})
+
+    def test_torn_line_is_ignored(self):
+        journal = Journal(self.snapshot)
+        journal.append('a.jpg', {'angle': 90})
+        journal.close()
+        with open(journal.filename, 'a') as f:
+            f.write('["b.jpg", {"ang')
+        # The next append starts on a line of its own
+        journal = Journal(self.snapshot)
+        journal.append('c.jpg', {'angle': 0})
+        journal.close()
+        entries = Journal(self.snapshot).load()
+        self.assertEqual(sorted(entries.keys()), ['a.jpg', 'c.jpg'])
+
+    def test_compact_merges_into_snapshot(self):
+        journal = Journal(self.snapshot, compact_lines=3)
+        for i in range(3):
+            journal.append('%i.jpg' % i, {'angle': i})
+        journal.wait()
+        journal.append('3.jpg', {'angle': 3})
+        journal.close()
+        self.assertFalse(os.path.exists(journal.compacting_file))
+        self.assertEqual(sorted(read_snapshot(self.snapshot).keys()), ['0.jpg', '1.jpg', '2.jpg'])
+        entries = Journal(self.snapshot).load()
+        self.assertEqual(sorted(entries.keys()), ['0.jpg', '1.jpg', '2.jpg', '3.jpg'])
+
+    def test_interrupted_compaction_is_replayed(self):
+        journal = Journal(self.snapshot)
+        journal.append('a.jpg', {'angle': 90})
+        journal.close()
+        os.rename(journal.filename, journal.compacting_file)
+        journal.append('b.jpg', {'angle': 0})
+        journal.close()
+        entries = Journal(self.snapshot).load()
+        self.assertEqual(sorted(entries.keys()), ['a.jpg', 'b.jpg'])
+
+    def test_checkpoint_starts_over(self):
+        journal = Journal(self.snapshot)
+        journal.append('a.jpg', {'angle': 90})
+        journal.checkpoint({'b.jpg': {'angle': 0}})
+        self.assertFalse(os.path.exists(journal.filename))
+        self.assertEqual(list(Journal(self.snapshot).load().keys()), ['b.jpg'])
+
+@unittest.skipIf(Directory is None, "needs pygame and PIL")
+class TestDirectorySave(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.snapshot = os.path.join(self.tmp, '.directory.json')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def test_save_leaves_the_snapshot_to_compaction(self):
+        directory = Directory(self.tmp)
+        directory.load(self.snapshot)
+        directory['a.jpg'] = Entry('a.jpg')
+        directory.save()
+        self.assertFalse(os.path.exists(self.snapshot))
+        self.assertIsNone(directory.journal.f)
+        directory = Directory(self.tmp)
+        directory.load(self.snapshot)
+        self.assertEqual(list(directory.keys()), ['a.jpg'])
+
+    def test_save_as_writes_a_snapshot(self):
+        directory = Directory(self.tmp)
+        directory.load(self.snapshot)
+        directory['a.jpg'] = Entry('a.jpg')
+        other = os.path.join(self.tmp, 'other.json')
+        directory.save(other)
+        self.assertEqual(list(read_snapshot(other).keys()), ['a.jpg'])
+
+if __name__ == '__main__':
+    unittest.main()
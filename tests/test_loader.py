@@ -0,0 +1,106 @@
+#!/usr/bin/env python3
+
+import threading
+import time
+import unittest
+from imagesgl.loader import Loader
+
+def wait_for(condition, timeout=5.0):
+    end = time.time() + timeout
+    while not condition():
+        if time.time() > end:
+            raise AssertionError("timed out")
+        time.sleep(0.005)
+
+class TestLoader(unittest.TestCase):
+    def setUp(self):
+        self.wakeups = []
+        self.loader = Loader(workers=1, callback=lambda: self.wakeups.append(1))
+        self.applied = []
+        # Holds the loader thread until released
+        self.gate = threading.Event()
+
+    def tearDown(self):
+        self.gate.set()
+
+    def block(self):
+        '''Keep the loader thread busy until the gate opens.'''
+        self.loader.request('block', self.load('block', block=True), 'other')
+        wait_for(lambda: self.loader._pending['block'].started)
+
+    def load(self, value, block=False):
+        def work():
+            if block:
+                self.gate.wait()
+            return lambda: self.applied.append(value)
+        return work
+
+    def test_results_are_applied_on_apply(self):
+        self.loader.request('a', self.load('a'), 'image')
+        wait_for(lambda: len(self.loader._done) == 1)
+        self.assertEqual(self.applied, [])
+        self.assertEqual(self.loader.apply(), 1)
+        self.assertEqual(self.applied, ['a'])
+        self.assertEqual(self.loader.depth, 0)
+
+    def test_one_wakeup_until_applied(self):
+        for key in 'abc':
+            self.loader.request(key, self.load(key), 'image')
+        wait_for(lambda: len(self.loader._done) == 3)
+        self.assertEqual(len(self.wakeups), 1)
+        self.loader.apply()
+        self.loader.request('d', self.load('d'), 'image')
+        wait_for(lambda: len(self.loader._done) == 1)
+        self.assertEqual(len(self.wakeups), 2)
+
+    def test_duplicate_request_is_dropped(self):
+        self.block()
+        self.assertTrue(self.loader.request('a', self.load('first'), 'image'))
+        self.assertFalse(self.loader.request('a', self.load('second'), 'image'))
+        self.gate.set()
+        wait_for(lambda: len(self.loader._done) == 2)
+        self.loader.apply()
+        # The newer function of a request that has not started runs
+        self.assertEqual(self.applied, ['block', 'second'])
+
+    def test_advance_drops_older_generations(self):
+        self.block()
+        self.loader.request('a', self.load('a'), 'image')
+        self.loader.request('t', self.load('t'), 'thumbnail')
+        self.loader.advance('image')
+        self.loader.request('b', self.load('b'), 'image')
+        self.gate.set()
+        wait_for(lambda: self.loader.depth == len(self.loader._done) and len(self.loader._done) == 3)
+        self.assertEqual(self.loader.apply(), 3)
+        self.assertEqual(sorted(self.applied), ['b', 'block', 't'])
+        self.assertEqual(self.loader.dropped, 1)
+
+    def test_request_again_keeps_it_wanted(self):
+        self.block()
+        self.loader.request('a', self.load('a'), 'image')
+        self.loader.advance('image')
+        self.loader.request('a', self.load('a'), 'image')
+        self.gate.set()
+        wait_for(lambda: len(self.loader._done) == 2)
+        self.loader.apply()
+        self.assertEqual(self.applied, ['block', 'a'])
+
+    def test_finished_results_of_older_generations_are_dropped(self):
+        self.loader.request('a', self.load('a'), 'image')
+        wait_for(lambda: len(self.loader._done) == 1)
+        self.loader.advance('image')
+        self.assertEqual(self.loader.apply(), 0)
+        self.assertEqual(self.applied, [])
+        self.assertEqual(self.loader.depth, 0)
+
+    def test_none_and_errors_apply_nothing(self):
+        def fail():
+            raise OSError("unreadable")
+        self.loader.request('none', lambda: None, 'image')
+        self.loader.request('fail', fail, 'image')
+        wait_for(lambda: self.loader.depth == 0)
+        self.assertEqual(self.loader.apply(), 0)
+        self.assertEqual(self.loader.loaded, 2)
+
+if __name__ == '__main__':
+    unittest.main()
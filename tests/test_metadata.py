@@ -0,0 +1,103 @@
+#!/usr/bin/env python3
+
+import os
+import shutil
+import struct
+import tempfile
+import unittest
+from imagesgl.metadata import read_metadata
+from imagesgl.metadata import TAG_MAKE, TAG_MODEL, TAG_ORIENTATION, TAG_EXIF_IFD, TAG_DATETIME_ORIGINAL
+
+def ifd(endian, entries, data_offset):
+    '''@return: tuple(ifd, data) - an IFD with its out-of-line values, which start at data_offset'''
+    out = struct.pack(endian + 'H', len(entries))
+    data = b''
+    for tag, kind, value in entries:
+        if kind == 2:
+            raw = value.encode() + b'\0'
+            if len(raw) <= 4:
+                field = raw.ljust(4, b'\0')
+            else:
+                field = struct.pack(endian + 'I', data_offset + len(data))
+                data += raw
+            n = len(raw)
+        elif kind == 3:
+            n, field = 1, struct.pack(endian + 'H', value) + b'\0\0'
+        else:
+            n, field = 1, struct.pack(endian + 'I', value)
+        out += struct.pack(endian + 'HHI', tag, kind, n) + field
+    return out + struct.pack(endian + 'I', 0), data
+
+def tiff(endian, ifd0, exif):
+    '''A TIFF header with IFD0 and an EXIF IFD, which IFD0 points to.'''
+    size0 = 2 + 12 * (len(ifd0) + 1) + 4
+    size1 = 2 + 12 * len(exif) + 4
+    ifd0 = ifd0 + [(TAG_EXIF_IFD, 4, 8 + size0)]
+    out0, data0 = ifd(endian, ifd0, 8 + size0 + size1)
+    out1, data1 = ifd(endian, exif, 8 + size0 + size1 + len(data0))
+    head = (b'II' if endian == '<' else b'MM') + struct.pack(endian + 'HI', 42, 8)
+    return head + out0 + out1 + data0 + data1
+
+def segment(code, data):
+    return struct.pack('>BBH', 0xFF, code, len(data) + 2) + data
+
+def jpeg(width, height, exif=None):
+    data = b'\xff\xd8'
+    data += segment(0xE0, b'JFIF\0\1\1\0\0\1\0\1\0\0')
+    if not exif is None:
+        data += segment(0xE1, b'Exif\0\0' + exif)
+    data += segment(0xC0, struct.pack('>BHHB', 8, height, width, 3) + b'\1\x22\0\2\x11\1\3\x11\1')
+    data += segment(0xDA, b'\3\1\0\2\x11\3\x11\0\x3f\0') + b'\0' * 64 + b'\xff\xd9'
+    return data
+
+class TestReadMetadata(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def read(self, data):
+        filename = os.path.join(self.tmp, 'image')
+        with open(filename, 'wb') as f:
+            f.write(data)
+        return read_metadata(filename)
+
+    def exif(self, endian, make='Canon', model='Canon EOS 5D', orientation=6, taken='2014:07:01 12:00:00'):
+        return tiff(endian,
+                    [(TAG_MAKE, 2, make), (TAG_MODEL, 2, model), (TAG_ORIENTATION, 3, orientation)],
+                    [(TAG_DATETIME_ORIGINAL, 2, taken)])
+
+    def test_jpeg_with_exif(self):
+        for endian in '<>':
+            metadata = self.read(jpeg(640, 480, self.exif(endian)))
+            self.assertEqual(metadata, {'width': 640, 'height': 480, 'orientation': 6,
+                                        'taken': '2014:07:01 12:00:00', 'camera': 'Canon EOS 5D'})
+
+    def test_camera_joins_make_and_model(self):
+        metadata = self.read(jpeg(640, 480, self.exif('<', make='NIKON', model='D70')))
+        self.assertEqual(metadata['camera'], 'NIKON D70')
+
+    def test_unset_capture_time(self):
+        metadata = self.read(jpeg(640, 480, self.exif('<', taken='0000:00:00 00:00:00')))
+        self.assertEqual(metadata['taken'], None)
+
+    def test_jpeg_without_exif(self):
+        metadata = self.read(jpeg(320, 200))
+        self.assertEqual(metadata, {'width': 320, 'height': 200, 'orientation': 1,
+                                    'taken': None, 'camera': None})
+
+    def test_broken_exif(self):
+        metadata = self.read(jpeg(320, 200, b'II\x2a\0\xff\xff\0\0'))
+        self.assertEqual((metadata['width'], metadata['orientation']), (320, 1))
+
+    def test_png(self):
+        data = b'\x89PNG\r\n\x1a\n' + struct.pack('>I', 13) + b'IHDR' + struct.pack('>II', 800, 600) + b'\x08\x02\0\0\0'
+        metadata = self.read(data)
+        self.assertEqual((metadata['width'], metadata['height'], metadata['orientation']), (800, 600, 1))
+
+    def test_unknown_format(self):
+        self.assertEqual(self.read(b'GIF89a' + b'\0' * 32), None)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,81 @@
+#!/usr/bin/env python3
+
+import os
+import shutil
+import tempfile
+import unittest
+from imagesgl.scanner import Scanner
+
+class TestScanIncremental(unittest.TestCase):
+    def setUp(self):
+        self.basepath = tempfile.mkdtemp()
+        self.scanner = Scanner(self.basepath, ext=['jpg'])
+
+    def tearDown(self):
+        shutil.rmtree(self.basepath)
+
+    def write(self, relpath, data=b'x'):
+        filename = os.path.join(self.basepath, relpath)
+        os.makedirs(os.path.dirname(filename), exist_ok=True)
+        with open(filename, 'wb') as f:
+            f.write(data)
+
+    def set_mtime(self, relpath, mtime_ns):
+        os.utime(os.path.join(self.basepath, relpath), ns=(mtime_ns, mtime_ns))
+
+    def test_first_scan_adds_accepted_files(self):
+        self.write('a.jpg')
+        self.write('sub/b.jpg')
+        self.write('sub/notes.txt')
+        folders = {}
+        result = self.scanner.scan_incremental(folders, {})
+        self.assertEqual(result.added, ['a.jpg', os.path.join('sub', 'b.jpg')])
+        self.assertEqual(result.changed, [])
+        self.assertEqual(result.removed, [])
+        self.assertEqual(sorted(folders.keys()), ['', 'sub'])
+        self.assertEqual(folders[''][1], ['sub'])
+        self.assertEqual(result.stats['a.jpg'][0], 1)
+
+    def test_changed_and_removed(self):
+        self.write('a.jpg')
+        self.write('b.jpg')
+        folders = {}
+        first = self.scanner.scan_incremental(folders, {})
+        known = dict(first.stats)
+        self.write('a.jpg', b'longer')
+        os.remove(os.path.join(self.basepath, 'b.jpg'))
+        self.write('c.jpg')
+        result = self.scanner.scan_incremental(folders, known, full=True)
+        self.assertEqual(result.added, ['c.jpg'])
+        self.assertEqual(result.changed, ['a.jpg'])
+        self.assertEqual(result.removed, ['b.jpg'])
+
+    def test_unchanged_folder_is_not_listed(self):
+        self.write('sub/a.jpg')
+        self.set_mtime('sub', 10 ** 18)
+        folders = {}
+        known = dict(self.scanner.scan_incremental(folders, {}).stats)
+        # Rewritten in place with the folder mtime kept, only a full scan sees it
+        self.write('sub/a.jpg', b'longer')
+        self.set_mtime('sub', 10 ** 18)
+        self.assertEqual(len(self.scanner.scan_incremental(folders, known)), 0)
+        result = self.scanner.scan_incremental(folders, known, full=True)
+        self.assertEqual(result.changed, [os.path.join('sub', 'a.jpg')])
+
+    def test_known_without_stat_is_not_changed(self):
+        self.write('a.jpg')
+        result = self.scanner.scan_incremental({}, {'a.jpg': None})
+        self.assertEqual(len(result), 0)
+        self.assertIn('a.jpg', result.stats)
+
+    def test_removed_folder(self):
+        self.write('sub/a.jpg')
+        folders = {}
+        known = dict(self.scanner.scan_incremental(folders, {}).stats)
+        shutil.rmtree(os.path.join(self.basepath, 'sub'))
+        result = self.scanner.scan_incremental(folders, known)
+        self.assertEqual(result.removed, [os.path.join('sub', 'a.jpg')])
+        self.assertEqual(list(folders.keys()), [''])
+
+if __name__ == '__main__':
+    unittest.main()
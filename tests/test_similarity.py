@@ -0,0 +1,81 @@
+#!/usr/bin/env python3
+
+import io
+import random
+import shutil
+import tempfile
+import unittest
+
+try:
+    from imagesgl.similarity import BKTree, distance
+except ImportError:
+    # The hashes need numpy and PIL
+    BKTree = None
+
+try:
+    from PIL import Image
+    from imagesgl.directory import Directory
+    from imagesgl.entry import Entry
+    from imagesgl.thumbpack import for_root
+except ImportError:
+    # The directory needs pygame and PIL through the entries
+    Directory = None
+
+@unittest.skipIf(BKTree is None, "needs numpy and PIL")
+class TestBKTree(unittest.TestCase):
+    def test_distance(self):
+        self.assertEqual(distance(0, 0), 0)
+        self.assertEqual(distance(0b1011, 0b0001), 2)
+        self.assertEqual(distance(0, (1 << 64) - 1), 64)
+
+    def test_empty(self):
+        self.assertEqual(BKTree().search(0, 64), [])
+
+    def test_equal_hashes_share_a_node(self):
+        tree = BKTree()
+        tree.add(5, 'a')
+        tree.add(5, 'b')
+        self.assertEqual(len(tree), 2)
+        self.assertEqual(tree.search(5, 0), [(0, 'a'), (0, 'b')])
+
+    def test_search_matches_linear_scan(self):
+        rnd = random.Random(1)
+        hashes = [rnd.getrandbits(64) for i in range(500)]
+        # Near copies of some hashes
+        hashes += [h ^ (1 << rnd.randrange(64)) for h in hashes[:50]]
+        tree = BKTree()
+        for i, h in enumerate(hashes):
+            tree.add(h, i)
+        for radius in (0, 3, 10, 28):
+            for h in hashes[:20]:
+                expected = sorted([(distance(h, o), i) for i, o in enumerate(hashes) if distance(h, o) <= radius])
+                self.assertEqual(tree.search(h, radius), expected)
+
+@unittest.skipIf(BKTree is None or Directory is None, "needs numpy, pygame and PIL")
+class TestPhashMisses(unittest.TestCase):
+    def setUp(self):
+        self.basepath = tempfile.mkdtemp()
+        self.directory = Directory(self.basepath)
+        self.directory['a.jpg'] = Entry('a.jpg')
+
+    def tearDown(self):
+        for_root(self.basepath).close()
+        shutil.rmtree(self.basepath)
+
+    def put_thumbnail(self, key):
+        data = io.BytesIO()
+        Image.new('RGB', (20, 20), (200, 100, 0)).save(data, 'JPEG')
+        for_root(self.basepath).put(key, data.getvalue())
+
+    def test_miss_is_tried_again_once_the_thumbnail_changes(self):
+        self.assertEqual(self.directory.unphashed_keys(), ['a.jpg'])
+        self.assertEqual(self.directory.apply_phashes(self.directory.read_phashes(['a.jpg'])), [])
+        self.assertEqual(self.directory.unphashed_keys(), [])
+        self.put_thumbnail('a.jpg')
+        self.assertEqual(self.directory.unphashed_keys(), ['a.jpg'])
+        self.directory.apply_phashes(self.directory.read_phashes(['a.jpg']))
+        self.assertFalse(self.directory['a.jpg'].phash is None)
+        self.assertEqual(self.directory.unphashed_keys(), [])
+
+if __name__ == '__main__':
+    unittest.main()
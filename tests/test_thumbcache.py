@@ -0,0 +1,56 @@
+#!/usr/bin/env python3
+
+import multiprocessing
+import shutil
+import tempfile
+import unittest
+from imagesgl import thumbcache
+from imagesgl.thumbcache import ThumbCache
+
+def _in_child(parent, results):
+    cache = thumbcache.shared()
+    results.put((cache is parent, thumbcache._orphans == [parent], parent.db is None, cache.get('a')))
+
+class TestThumbCache(unittest.TestCase):
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        thumbcache.configure(self.path, 1)
+
+    def tearDown(self):
+        thumbcache.shared().close()
+        thumbcache.configure()
+        shutil.rmtree(self.path)
+
+    def test_put_and_get(self):
+        cache = ThumbCache(self.path)
+        self.assertEqual(cache.get('a'), None)
+        cache.put('a', b'aaaa')
+        self.assertEqual(cache.get('a'), b'aaaa')
+        cache.close()
+
+    def test_least_recently_used_are_evicted(self):
+        cache = ThumbCache(self.path, max_bytes=10)
+        cache.put('a', b'aaaa')
+        cache.put('b', b'bbbb')
+        self.assertEqual(cache.get('a'), b'aaaa')
+        # The time of last use is in seconds, so b is made the oldest by hand
+        cache.db.execute('UPDATE thumbnails SET atime = 0 WHERE key = ?', ('b',))
+        cache.put('c', b'cccc')
+        self.assertEqual(cache.get('b'), None)
+        self.assertEqual(cache.get('a'), b'aaaa')
+        cache.close()
+
+    def test_forked_child_opens_its_own(self):
+        parent = thumbcache.shared()
+        parent.put('a', b'aaaa')
+        ctx = multiprocessing.get_context('fork')
+        results = ctx.Queue()
+        p = ctx.Process(target=_in_child, args=(parent, results))
+        p.start()
+        self.assertEqual(results.get(timeout=10), (False, True, False, b'aaaa'))
+        p.join()
+        self.assertEqual(thumbcache._orphans, [])
+        self.assertEqual(parent.get('a'), b'aaaa')
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,102 @@
+#!/usr/bin/env python3
+
+import os
+import shutil
+import tempfile
+import unittest
+from imagesgl.thumbpack import ThumbPack, INDEX_FILE, encode_pyramid, decode_pyramid
+
+class TestThumbPack(unittest.TestCase):
+    def setUp(self):
+        self.basepath = tempfile.mkdtemp()
+        self.pack = ThumbPack(self.basepath)
+        self.pack.open()
+
+    def tearDown(self):
+        self.pack.close()
+        shutil.rmtree(self.basepath)
+
+    def reopen(self):
+        self.pack.close()
+        self.pack = ThumbPack(self.basepath)
+        self.pack.open()
+
+    def test_put_and_get(self):
+        self.pack.put('a.jpg', b'aaaa')
+        self.pack.put('b.jpg', b'bb')
+        self.assertEqual(self.pack.get('a.jpg'), b'aaaa')
+        self.assertEqual(self.pack.get('a.jpg', 2), b'aa')
+        self.assertEqual(self.pack.get('b.jpg'), b'bb')
+        self.assertEqual(self.pack.get('c.jpg'), None)
+        self.assertEqual(len(self.pack), 2)
+
+    def test_replace_remove_and_rename(self):
+        self.pack.put('a.jpg', b'aaaa')
+        self.pack.put('b.jpg', b'bb')
+        location = self.pack.location('a.jpg')
+        self.pack.put('a.jpg', b'AAAA')
+        self.assertNotEqual(self.pack.location('a.jpg'), location)
+        self.pack.remove('b.jpg')
+        self.pack.rename('a.jpg', 'c.jpg')
+        self.assertEqual(self.pack.garbage, 6)
+        self.assertFalse('a.jpg' in self.pack)
+        self.assertEqual(self.pack.get('c.jpg'), b'AAAA')
+
+    def test_index_is_replayed(self):
+        self.pack.put('a.jpg', b'aaaa')
+        self.pack.put('b.jpg', b'bb')
+        self.pack.put('a.jpg', b'AAAA')
+        self.pack.rename('b.jpg', 'c.jpg')
+        self.pack.close()
+        with open(os.path.join(self.basepath, INDEX_FILE), 'a') as f:
+            f.write('["d.jpg", 1')
+        self.reopen()
+        self.assertEqual(sorted(self.pack.index.keys()), ['a.jpg', 'c.jpg'])
+        self.assertEqual(self.pack.get('a.jpg'), b'AAAA')
+        self.assertEqual(self.pack.get('c.jpg'), b'bb')
+        self.assertEqual(self.pack.garbage, 4)
+
+    def test_compact(self):
+        self.pack.put('a.jpg', b'aaaa')
+        self.pack.put('b.jpg', b'bb')
+        self.assertFalse(self.pack.compact())
+        self.pack.put('a.jpg', b'AAAA')
+        self.pack.remove('b.jpg')
+        old_pack = self.pack.pack_file
+        self.assertTrue(self.pack.compact())
+        self.assertFalse(os.path.exists(old_pack))
+        self.assertEqual(os.path.getsize(self.pack.pack_file), 4)
+        self.assertEqual(self.pack.garbage, 0)
+        self.pack.put('e.jpg', b'eee')
+        self.reopen()
+        self.assertEqual(self.pack.generation, 1)
+        self.assertEqual(self.pack.get('a.jpg'), b'AAAA')
+        self.assertEqual(self.pack.get('e.jpg'), b'eee')
+
+class TestPyramid(unittest.TestCase):
+    images = {(1, 1): b'\xff\xd8square', (3, 2): b'\xff\xd8wide', (2, 3): b'\xff\xd8tall'}
+
+    def test_round_trip(self):
+        data = encode_pyramid(200, 5, self.images)
+        self.assertEqual(decode_pyramid(data), (200, 5, self.images))
+
+    def test_single_thumbnail_from_before_pyramids(self):
+        self.assertEqual(decode_pyramid(b'\xff\xd8old'), None)
+
+    def test_header_from_pack(self):
+        basepath = tempfile.mkdtemp()
+        try:
+            pack = ThumbPack(basepath)
+            pack.open()
+            pack.put('a.jpg', encode_pyramid(200, 5, self.images, preview=True))
+            pack.put('b.jpg', b'\xff\xd8old')
+            header = pack.header('a.jpg')
+            self.assertEqual((header['block_size'], header['border'], header['preview']), (200, 5, True))
+            self.assertEqual(sorted([(w, h) for w, h, o, l in header['sizes']]), sorted(self.images.keys()))
+            self.assertEqual(pack.header('b.jpg'), None)
+            pack.close()
+        finally:
+            shutil.rmtree(basepath)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,57 @@
+#!/usr/bin/env python3
+
+import unittest
+
+try:
+    import pygame
+    from imagesgl.tiles import TiledImage, turn
+except ImportError:
+    pygame = None
+
+def surface(w, h):
+    return pygame.Surface((w, h), 0, 32)
+
+@unittest.skipIf(pygame is None, "needs pygame")
+class TestTiledImage(unittest.TestCase):
+    def test_level_sizes_halve(self):
+        tiled = TiledImage(surface(1000, 800))
+        tiled._level(0.2)
+        self.assertEqual([level.get_size() for level in tiled.levels],
+                         [(1000, 800), (500, 400), (250, 200)])
+
+    def test_scales_of_levels_are_drawn_directly(self):
+        tiled = TiledImage(surface(1000, 800))
+        self.assertEqual(tiled._level(1.0), (0, 1.0))
+        self.assertEqual(tiled._level(0.5), (1, 1.0))
+        self.assertEqual(tiled._level(0.25), (2, 1.0))
+
+    def test_smallest_level_at_least_as_large(self):
+        tiled = TiledImage(surface(1000, 800))
+        k, g = tiled._level(0.3)
+        self.assertEqual(k, 1)
+        self.assertAlmostEqual(g, 0.6)
+        k, g = tiled._level(0.7)
+        self.assertEqual(k, 0)
+        self.assertAlmostEqual(g, 0.7)
+
+    def test_enlarging_uses_the_original(self):
+        tiled = TiledImage(surface(1000, 800))
+        self.assertEqual(tiled._level(3.0), (0, 3.0))
+        self.assertEqual(len(tiled.levels), 1)
+
+    def test_levels_stop_at_two_pixels(self):
+        tiled = TiledImage(surface(8, 4))
+        k, g = tiled._level(0.01)
+        self.assertEqual([level.get_size() for level in tiled.levels], [(8, 4), (4, 2), (2, 1)])
+        self.assertEqual(k, 2)
+        self.assertAlmostEqual(g, 0.04)
+
+    def test_quarter_turns_swap_sides(self):
+        original = surface(30, 20)
+        self.assertIs(turn(original, 0), original)
+        self.assertEqual(turn(original, 90).get_size(), (20, 30))
+        self.assertEqual(turn(original, 180).get_size(), (30, 20))
+        self.assertEqual(TiledImage(original, angle=270).size(0.5), (10, 15))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,76 @@
+#!/usr/bin/env python3
+
+import os
+import shutil
+import tempfile
+import unittest
+from imagesgl.scanner import Scanner
+from imagesgl.watcher import Watcher, _EVENT, IN_MOVED_FROM, IN_MOVED_TO
+
+class FakeDirectory:
+    def __init__(self, stats):
+        self.stats = stats
+
+    def __contains__(self, key):
+        return key in self.stats
+
+    def keys(self):
+        return self.stats.keys()
+
+    def stat_of(self, key):
+        return self.stats.get(key)
+
+def event(mask, cookie, name, wd=1):
+    name = os.fsencode(name) + b'\0'
+    return _EVENT.pack(wd, mask, cookie, len(name)) + name
+
+class TestWatcherMoves(unittest.TestCase):
+    def setUp(self):
+        self.basepath = tempfile.mkdtemp()
+        self.watcher = Watcher(Scanner(self.basepath, ext=['jpg']), move_timeout=1.0)
+        self.watcher._watches[1] = ''
+
+    def tearDown(self):
+        shutil.rmtree(self.basepath)
+
+    def touch(self, relpath):
+        with open(os.path.join(self.basepath, relpath), 'wb') as f:
+            f.write(b'x')
+
+    def test_move_split_across_batches(self):
+        directory = FakeDirectory({'a.jpg': (1, 0, 0)})
+        self.watcher._read(event(IN_MOVED_FROM, 7, 'a.jpg'))
+        result = self.watcher.drain(directory)
+        self.assertEqual(len(result), 0)
+        self.touch('b.jpg')
+        self.watcher._read(event(IN_MOVED_TO, 7, 'b.jpg'))
+        result = self.watcher.drain(directory)
+        self.assertEqual(result.moved, [('a.jpg', 'b.jpg')])
+        self.assertEqual(result.removed, [])
+        self.assertEqual(result.added, [])
+
+    def test_move_out_of_tree_expires_as_deletion(self):
+        directory = FakeDirectory({'a.jpg': (1, 0, 0)})
+        self.watcher._read(event(IN_MOVED_FROM, 7, 'a.jpg'))
+        self.assertEqual(len(self.watcher.drain(directory)), 0)
+        cookie, (relpath, isdir, started) = next(iter(self.watcher._moves.items()))
+        self.watcher._expire(started + 1.0)
+        self.assertEqual(len(self.watcher._moves), 0)
+        result = self.watcher.drain(directory)
+        self.assertEqual(result.removed, ['a.jpg'])
+
+    def test_moves_beyond_max_moves_expire(self):
+        self.watcher.max_moves = 2
+        self.watcher._read(b''.join([event(IN_MOVED_FROM, c, '%i.jpg' % c) for c in range(1, 5)]))
+        self.assertEqual([m[0] for m in self.watcher._moves.values()], ['3.jpg', '4.jpg'])
+        self.assertEqual(self.watcher._paths, set(['1.jpg', '2.jpg']))
+
+    def test_move_within_batch(self):
+        directory = FakeDirectory({'a.jpg': (1, 0, 0)})
+        self.touch('b.jpg')
+        self.watcher._read(event(IN_MOVED_FROM, 7, 'a.jpg') + event(IN_MOVED_TO, 7, 'b.jpg'))
+        result = self.watcher.drain(directory)
+        self.assertEqual(result.moved, [('a.jpg', 'b.jpg')])
+
+if __name__ == '__main__':
+    unittest.main()